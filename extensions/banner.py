@@ -5,11 +5,11 @@ Allows saving banner designs and using them to write messages
 """
 
 from .utils.banner import *
-from .utils.utils import UserError, BASE_FONT
-from .utils.splitting import SplitMode
-import json
-from json import JSONDecoder
-import os
+from .utils.utils import META, UserError, BASE_FONT, BASE_FONT_LOCK
+from .utils.splitting import SplitMode, SPLIT_STATS
+from .utils.rendering import RENDER_EXECUTOR, RENDER_ADMISSION, ENCODED_PNGS, encode_png, png_attachment
+from .utils.storage import BannerStorage, JSONBannerStorage, SQLiteBannerStorage, UserDataView
+import re
 from PIL import Image, ImageDraw
 import hikari, lightbulb
 
@@ -18,24 +18,32 @@ loader = lightbulb.Loader()
 DIRECTION_CHOICES = choicify(["up", "down", "left", "right"])
 RED = "#ee2d2d"
 
-banner_designs: dict[int, Banner] = {}
-banner_sets: dict[int, dict[str, BannerSet]] = {}
-last_used: dict[int, str] = {}
-
-if os.path.exists("data.json"):
-    with open("data.json", encoding="utf-8") as f:
-        data = JSONDecoder(object_hook = banner_json_decode_hook).decode(f.read())
-    banner_designs = {int(k): v for k, v in data["designs"].items()}
-    banner_sets = {int(k): v for k, v in data["sets"].items()}
-    last_used = {int(k): v for k, v in data["last_used"].items()}
-
-def save_banner_data():
-    with open("data.json", "w") as f:
-        json.dump({
-            "designs": banner_designs,
-            "sets": banner_sets,
-            "last_used": last_used
-        }, f, cls = BannerJSONEncoder, indent = 4)
+SAVE_DEBOUNCE: float = META.get("Save debounce seconds", 5)
+SAVE_MAX_DELAY: float = META.get("Save max delay seconds", 30)
+BANNER_STORAGE: str = META.get("Banner storage", "json")
+LAZY_BANNER_LOADING: bool = META.get("Lazy banner loading", False)
+BANNER_IDLE_MINUTES: int = META.get("Banner idle minutes", 0)
+
+if BANNER_STORAGE == "sqlite":
+    storage: BannerStorage = SQLiteBannerStorage("data.db", SAVE_DEBOUNCE, SAVE_MAX_DELAY, migrate_from="data.json")
+else:
+    storage: BannerStorage = JSONBannerStorage("data.json", SAVE_DEBOUNCE, SAVE_MAX_DELAY, lazy=LAZY_BANNER_LOADING)
+banner_designs: UserDataView[Banner] = storage.designs
+banner_sets: UserDataView[dict[str, BannerSet]] = storage.sets
+last_used: UserDataView[str] = storage.last_used
+
+def save_banner_data(user_id: int):
+    """Schedule saving the banner data of the user"""
+    storage.mark_dirty(user_id)
+
+@loader.listener(hikari.StoppingEvent)
+async def on_stopping(_: hikari.StoppingEvent) -> None:
+    await storage.flush()
+
+@loader.task(lightbulb.uniformtrigger(minutes=1), True, -1, -1)
+async def evict_idle_banner_data() -> None:
+    if BANNER_IDLE_MINUTES > 0:
+        storage.evict_idle(BANNER_IDLE_MINUTES*60)
 
 async def layer_autocomplete(ctx: lightbulb.AutocompleteContext[str]) -> None:
     banner = banner_designs.get(ctx.interaction.user.id)
@@ -63,13 +71,48 @@ def number_of_columns_for(number_of_banners):
     if number_of_banners <= 56: return 8
     return 9
 
+def banner_catalog_text_length(banners: dict[str, Banner]) -> int:
+    dummy_image = Image.new("RGBA", (1, 1))
+    dummy_draw = ImageDraw.Draw(dummy_image)
+    with BASE_FONT_LOCK:
+        return int(
+            max(dummy_draw.textlength(name, BASE_FONT) for name in banners.keys())
+        )
+
+def banner_catalog_size(number_of_banners: int, max_text_length: int) -> tuple[int, int]:
+    columns = number_of_columns_for(number_of_banners)
+    return (
+        10 + (max_text_length + 40) * columns,
+        60 * ((number_of_banners + columns - 1) // columns),
+    )
+
+def banner_catalog_image(banners: dict[str, Banner], max_text_length: int | None = None) -> Image.Image:
+    """
+    The banners in a grid, sorted and labelled by their names
+    :param int max_text_length: The result of `banner_catalog_text_length` if it was already measured
+    """
+    if max_text_length is None: max_text_length = banner_catalog_text_length(banners)
+    columns = number_of_columns_for(len(banners))
+    image = Image.new("RGBA", banner_catalog_size(len(banners), max_text_length))
+    draw = ImageDraw.Draw(image)
+    for i, (name, banner) in enumerate(
+        sorted(list(banners.items()), key=lambda x: x[0].lower())
+    ):
+        x = 10 + (max_text_length + 40) * (i % columns)
+        y = 10 + 60 * (i // columns)
+        image.paste(banner.render(), (x, y))
+        with BASE_FONT_LOCK:
+            draw.text((x + 30, y + 20), name, "#ffffff", BASE_FONT, anchor="lm")
+    return image
+
 def get_working_set(user_id: int, set: str, update_last_used: bool = True) -> tuple[BannerSet, str]:
     banner_set_name = set or last_used.get(user_id)
     if not banner_set_name: raise UserError("You must have a banner set")
     banner_sets.setdefault(user_id, {})
     if banner_set_name not in banner_sets[user_id]: raise UserError(f"Banner set {banner_set_name} does not exist")
-    if update_last_used:
+    if update_last_used and last_used.get(user_id) != banner_set_name:
         last_used[user_id] = banner_set_name
+        save_banner_data(user_id)
     return banner_sets[user_id][banner_set_name], banner_set_name
 
 async def set_autocomplete(ctx: lightbulb.AutocompleteContext[str]) -> None:
@@ -119,7 +162,7 @@ class From_code(
     async def from_code(self, ctx: lightbulb.Context) -> None:
         banner_code = self.code
         banner = banner_designs[ctx.user.id] = Banner.from_banner_code(banner_code)
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await respond_with_banner(ctx, banner)
 
 
@@ -137,7 +180,7 @@ class from_text(
     async def from_text(self, ctx: lightbulb.Context) -> None:
         banner_text = self.text
         banner = banner_designs[ctx.user.id] = Banner.from_text(banner_text)
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await respond_with_banner(ctx, banner)
 
 
@@ -156,7 +199,7 @@ class from_url(
     async def from_url(self, ctx: lightbulb.Context) -> None:
         banner_url = self.url
         banner = banner_designs[ctx.user.id] = Banner.from_banner_url(banner_url)
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await respond_with_banner(ctx, banner)
 
 
@@ -176,7 +219,7 @@ class save(
         banner_set, banner_set_name = get_working_set(ctx.user.id, self.set)
         if ctx.user.id not in banner_designs: raise UserError("You must have a banner design")
         banner_set.banners[self.name] = banner_designs[ctx.user.id].copy()
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await ctx.respond(
             f"Saved banner as `{self.name}` to set `{banner_set_name}`!",
             ephemeral = True,
@@ -245,12 +288,14 @@ class set_create(
         banner_sets.setdefault(ctx.user.id, {})
         banner_sets[ctx.user.id][self.name] = banner_set
         last_used[ctx.user.id] = self.name
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await ctx.respond(
             f"Created banner set `{self.name}`!",
             ephemeral = True,
         )
 
+MAX_SAY_SPACING = 400 # Pixels of margin or spacing
+
 @loader.command
 class say(
     lightbulb.SlashCommand,
@@ -264,16 +309,21 @@ class say(
     scale = lightbulb.integer(
         "scale",
         "The value to scale by. Default is 2x texture size",
+        min_value=1,
         default=2,
     )
     margin = lightbulb.integer(
         "margin",
         "The margin of pixels. Default is 4x the scale",
+        min_value=0,
+        max_value=MAX_SAY_SPACING,
         default=None,
     )
     spacing = lightbulb.integer(
         "spacing",
         "The space between any two banners in pixels. Default is 4x the scale",
+        min_value=0,
+        max_value=MAX_SAY_SPACING,
         default=None,
     )
 
@@ -298,8 +348,7 @@ class say(
             #         raise UserError(f"Banner set {banner_set_name} does not have a banner for {word}")
             #     banners[-1].append(banner_set.banners[word])
         split_mode = banner_set.split_mode
-        split_func = split_mode.split
-        names = list(banner_set.banners.keys())
+        name_index = banner_set.name_index
         banners: list[list[Banner | None]] = []
         for line in words:
             banners.append([])
@@ -307,7 +356,7 @@ class say(
                 if i > 0: banners[-1].append(None)
                 subwords = word.split()
                 for subword in subwords:
-                    split = split_func(subword, names)
+                    split = name_index.split(subword, split_mode)
                     if split is None:
                         raise UserError(
                             f"Banner set {banner_set_name} doesn’t have a banner for “{subword}”"
@@ -315,65 +364,19 @@ class say(
                             f"Could not split “{subword}” into {banner_set_name} banners"
                         )
                     banners[-1] += [banner_set.banners[b] for b in split]
-        output = [
-            [
-                (
-                    banner.image.resize(
-                        (20 * scale, 40 * scale), Image.Resampling.NEAREST
-                    )
-                    if banner
-                    else None
-                )
-                for banner in line
-            ]
-            for line in banners
-        ]
-        row_length = max(map(len, output))
-        output = [row + [None] * (row_length - len(row)) for row in output]
-        image_rows, image_cols = len(output), len(output[0])
-        if banner_set.writing_direction.value % 2 == 0:
-            image_rows, image_cols = image_cols, image_rows
-        image_width = image_cols * 20 * scale + margin * 2 + spacing * (image_cols - 1)
-        image_height = image_rows * 40 * scale + margin * 2 + spacing * (image_rows - 1)
-        image = Image.new("RGBA", (image_width, image_height))
-        for r, row in enumerate(output):
-            if banner_set.newline_direction == Direction.Up:
-                paste_row = image_rows - r - 1
-            elif banner_set.newline_direction == Direction.Down:
-                paste_row = r
-            elif banner_set.newline_direction == Direction.Left:
-                paste_col = image_cols - r - 1
-            elif banner_set.newline_direction == Direction.Right:
-                paste_col = r
-            else:
-                raise ValueError("Invalid newline direction")
-            for c, sprite in enumerate(row):
-                if not sprite:
-                    continue
-                if banner_set.writing_direction == Direction.Up:
-                    paste_row = image_rows - c - 1
-                elif banner_set.writing_direction == Direction.Down:
-                    paste_row = c
-                elif banner_set.writing_direction == Direction.Left:
-                    paste_col = image_cols - c - 1
-                elif banner_set.writing_direction == Direction.Right:
-                    paste_col = c
-                else:
-                    raise ValueError("Invalid writing direction")
-                paste_x = paste_col * 20 * scale + margin + spacing * paste_col
-                paste_y = paste_row * 40 * scale + margin + spacing * paste_row
-                image.paste(sprite, (paste_x, paste_y))
-
-        async def say_callback(img):
-            await ctx.respond(
-                writing_description(
-                    banners, banner_set.writing_direction, banner_set.newline_direction
-                ),
-                attachment=hikari.File(img),
-                ephemeral = True,
+        width, height = grid_size(*grid_shape(banners, banner_set.writing_direction), scale, margin, spacing)
+        async with RENDER_ADMISSION.admit(ctx.user.id, width * height):
+            image = await RENDER_EXECUTOR.run(
+                render_banner_grid_png,
+                banners, banner_set.writing_direction, banner_set.newline_direction, scale, margin, spacing
             )
-
-        await save_temporarily(say_callback, image)
+        await ctx.respond(
+            writing_description(
+                banners, banner_set.writing_direction, banner_set.newline_direction
+            ),
+            attachment=hikari.Bytes(image, "banner.png"),
+            ephemeral = True,
+        )
 
 
 @set_cmd_group.register
@@ -453,7 +456,7 @@ class set_edit(
         new_banner_set.banners = banner_set.banners
         banner_sets[ctx.user.id].pop(banner_set_name)
         banner_sets[ctx.user.id][new_name] = new_banner_set
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await ctx.respond(
             f"Edited banner set `{new_name}`!",
             ephemeral = True,
@@ -476,7 +479,7 @@ class set_delete(
         if last_used[ctx.user.id] == banner_set_name:
             last_used.pop(ctx.user.id, None)
         banner_sets[ctx.user.id].pop(banner_set_name, None)
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await ctx.respond(
             f"Deleted banner set `{banner_set_name}`!",
             ephemeral = True,
@@ -499,7 +502,7 @@ class delete(
         banner_set, banner_set_name = get_working_set(ctx.user.id, self.set)
         if self.name not in banner_set.banners: raise UserError(f"Banner {self.name} does not exist")
         banner_set.banners.pop(self.name)
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await ctx.respond(
             f"Deleted banner `{self.name}` from set `{banner_set_name}`!",
             ephemeral = True,
@@ -526,7 +529,7 @@ class rename(
         banner_set.banners[self.new_name] = banner_set.banners.pop(
             self.name
         )
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await ctx.respond(
             f"Renamed banner `{self.name}` to `{self.new_name}` from set `{banner_set_name}`!",
             ephemeral = True,
@@ -551,7 +554,7 @@ class set_rename(
             ctx.user.id
         ].pop(self.name)
         last_used[ctx.user.id] = self.new_name
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await ctx.respond(
             f"Renamed banner set `{self.name}` to `{self.new_name}`!",
             ephemeral = True,
@@ -597,36 +600,21 @@ class set_info(
         banner_set, banner_set_name = get_working_set(ctx.user.id, self.set)
         banners = banner_set.banners
         num_banners_text = "0 banners"
-        image = None
+        attachment = None
         if banners:
             num_banners_text = (
                 f"{len(banners)} banner{'s' if len(banners) != 1 else ''}"
             )
-            dummy_image = Image.new("RGBA", (1, 1))
-            dummy_draw = ImageDraw.Draw(dummy_image)
-            max_text_length = int(
-                max(dummy_draw.textlength(name, BASE_FONT) for name in banners.keys())
-            )
-            columns = number_of_columns_for(len(banners))
-            image = Image.new(
-                "RGBA",
-                (
-                    10 + (max_text_length + 40) * columns,
-                    60 * ((len(banners) + columns - 1) // columns),
-                ),
-            )
-            draw = ImageDraw.Draw(image)
-            for i, (name, banner) in enumerate(
-                sorted(list(banners.items()), key=lambda x: x[0].lower())
-            ):
-                x = 10 + (max_text_length + 40) * (i % columns)
-                y = 10 + 60 * (i // columns)
-                image.paste(banner.image, (x, y))
-                draw.text((x + 30, y + 20), name, "#ffffff", BASE_FONT, anchor="lm")
-
-        async def list_callback(img):
-            await ctx.respond(
-                f"""
+            banners = dict(banners)
+            # Measuring the names takes the font lock, so it is kept off the event loop
+            max_text_length = await RENDER_EXECUTOR.run(banner_catalog_text_length, banners)
+            width, height = banner_catalog_size(len(banners), max_text_length)
+            async with RENDER_ADMISSION.admit(ctx.user.id, width * height):
+                image = await RENDER_EXECUTOR.run(banner_catalog_image, banners, max_text_length)
+                attachment = await png_attachment(image, reuse=True)
+
+        await ctx.respond(
+            f"""
 # Banner set: {banner_set_name}
 Writing direction: {banner_set.writing_direction.name.title()}
 Newline direction: {banner_set.newline_direction.name.title()}
@@ -635,11 +623,144 @@ Newline character: `{banner_set.newline_char}`
 Split mode: `{banner_set.split_mode.value}`
 ## {num_banners_text}
 """.strip(),
-                attachment=hikari.File(img) if img is not None else None,
-                ephemeral = True,
-            )
+            attachment=attachment,
+            ephemeral = True,
+        )
+
 
-        await save_temporarily(list_callback, image)
+MAX_IMPORT_BANNERS = 5000
+MAX_IMPORT_FILE_BYTES = 1_000_000
+IMPORT_PREVIEW_BANNERS = 60
+
+@set_cmd_group.register
+class set_import(
+    lightbulb.SlashCommand,
+    name="import",
+    description="Import many banners into a set at once",
+):
+    names = lightbulb.string(
+        "names",
+        "Names for the banners without one, in order, separated by spaces or commas",
+        default=None,
+    )
+    url = lightbulb.string(
+        "url", "A banner-writer.web.app image URL with several banners", default=None
+    )
+    file = lightbulb.attachment(
+        "file", "A text file with a banner code or URL per line, optionally preceded by the name, "
+        "or an exported set", default=None
+    )
+    set = lightbulb.string(
+        "set", "The name of the set. Created if it does not exist. Last used by default",
+        autocomplete=set_autocomplete, default=None
+    )
+    replace = lightbulb.boolean(
+        "replace", "Remove the banners already in the set. Default is false", default=False
+    )
+
+    @lightbulb.invoke
+    async def set_import(self, ctx: lightbulb.Context) -> None:
+        if not self.url and not self.file: raise UserError("Give a banner URL or a file")
+        banner_set_name = self.set or last_used.get(ctx.user.id)
+        if not banner_set_name: raise UserError("You must have a banner set")
+        if set(banner_set_name) & set(" ,./|_"): raise UserError(f"Invalid set name: {banner_set_name}")
+        await ctx.defer(ephemeral=True)
+        entries: list[tuple[str | None, Banner]] = []
+        exported_set: BannerSet | None = None
+        try:
+            if self.url:
+                entries += [
+                    (None, banner) for line in Banner.from_bannerwriter_url_multi(self.url) for banner in line if banner
+                ]
+            if self.file:
+                if self.file.size > MAX_IMPORT_FILE_BYTES:
+                    raise UserError(f"The file must be at most {MAX_IMPORT_FILE_BYTES:,} bytes")
+                data = await self.file.read()
+                if data.startswith(BANNER_SET_MAGIC):
+                    exported_set = banner_set_from_bytes(data)
+                    entries += exported_set.banners.items()
+                else:
+                    entries += parse_banner_list(data.decode("utf-8"))
+        except (AssertionError, ValueError, UnicodeDecodeError) as e:
+            raise UserError(f"Could not read the banners: {e}")
+        if not entries: raise UserError("No banners to import")
+        if len(entries) > MAX_IMPORT_BANNERS: raise UserError(f"Cannot import more than {MAX_IMPORT_BANNERS} banners at once")
+
+        names = re.split(r"[\s,]+", self.names.strip()) if self.names and self.names.strip() else []
+        unnamed = sum(name is None for name, _ in entries)
+        if len(names) != unnamed:
+            raise UserError(f"{unnamed} banner{'s' if unnamed != 1 else ''} need{'s' if unnamed == 1 else ''} a name, "
+                            f"but {len(names)} name{'s were' if len(names) != 1 else ' was'} given")
+        names_iter = iter(names)
+        imported: dict[str, Banner] = {}
+        for name, banner in entries:
+            name = name or next(names_iter)
+            if name in imported: raise UserError(f"Banner {name} is imported twice")
+            imported[name] = banner
+
+        user_sets = banner_sets.setdefault(ctx.user.id, {})
+        created = banner_set_name not in user_sets
+        if created and exported_set:
+            exported_set.banners.clear()
+            user_sets[banner_set_name] = exported_set
+        elif created:
+            user_sets[banner_set_name] = BannerSet(Direction.Right, Direction.Down, "-", "/", SplitMode.No)
+        banner_set = user_sets[banner_set_name]
+        if self.replace: banner_set.banners.clear()
+        banner_set.banners.update(imported)
+        last_used[ctx.user.id] = banner_set_name
+        save_banner_data(ctx.user.id)
+
+        response = (f"Imported {len(imported)} banner{'s' if len(imported) != 1 else ''} "
+                    f"into {'new ' if created else ''}set `{banner_set_name}`!")
+        preview = dict(list(imported.items())[:IMPORT_PREVIEW_BANNERS])
+        attachment = None
+        # The import is already saved, so a busy renderer only costs the preview
+        try:
+            max_text_length = await RENDER_EXECUTOR.run(banner_catalog_text_length, preview)
+            width, height = banner_catalog_size(len(preview), max_text_length)
+            async with RENDER_ADMISSION.admit(ctx.user.id, width * height):
+                image = await RENDER_EXECUTOR.run(banner_catalog_image, preview, max_text_length)
+                attachment = await png_attachment(image)
+        except UserError as e:
+            response += f" The preview could not be rendered: {e}"
+        else:
+            if len(imported) > IMPORT_PREVIEW_BANNERS: response += f" Showing the first {IMPORT_PREVIEW_BANNERS}."
+        await ctx.respond(response, attachment=attachment, ephemeral = True)
+
+
+@set_cmd_group.register
+class set_export(
+    lightbulb.SlashCommand,
+    name="export",
+    description="Export a banner set as a file that can be imported again",
+):
+    set = lightbulb.string(
+        "set", "The name of the set. Last used by default", autocomplete=set_autocomplete, default=None
+    )
+    format = lightbulb.string(
+        "format",
+        "Text lists the banner codes by name. Binary is smaller and keeps the set settings. Default is text",
+        choices=[lightbulb.Choice("Text", "text"), lightbulb.Choice("Binary", "binary")],
+        default="text",
+    )
+
+    @lightbulb.invoke
+    async def set_export(self, ctx: lightbulb.Context) -> None:
+        banner_set, banner_set_name = get_working_set(ctx.user.id, self.set)
+        if self.format == "binary":
+            try:
+                attachment = hikari.Bytes(banner_set_to_bytes(banner_set), f"{banner_set_name}.bset")
+            except ValueError as e:
+                raise UserError(f"{e}. Export the set as text instead")
+        else:
+            attachment = hikari.Bytes(banner_set_to_text(banner_set).encode("utf-8"), f"{banner_set_name}.txt")
+        await ctx.respond(
+            f"Exported {len(banner_set.banners)} banner{'s' if len(banner_set.banners) != 1 else ''} "
+            f"from set `{banner_set_name}`!",
+            attachment=attachment,
+            ephemeral = True,
+        )
 
 
 @banner_cmd_group.register
@@ -659,7 +780,7 @@ class load(
         banner = banner_set.banners.get(self.name)
         if not banner: raise UserError(f"Banner {self.name} does not exist")
         banner_designs[ctx.user.id] = banner.copy()
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await respond_with_banner(ctx, banner)
 
 
@@ -720,15 +841,11 @@ class add(
         index = None
         if self.layer is not None:
             index = layer_to_index(ctx, self.layer)
-        for pattern in Pattern:
-            if pattern.pretty_name == self.pattern:
-                break
-        else:
+        pattern = PRETTY_NAME_TO_PATTERN.get(self.pattern)
+        if pattern is None:
             raise UserError(f"Invalid pattern: {self.pattern}")
-        for color in Color:
-            if color.pretty_name == self.color:
-                break
-        else:
+        color = PRETTY_NAME_TO_COLOR.get(self.color)
+        if color is None:
             raise UserError(f"Invalid color: {self.color}") # Should be impossible
         new_layer = Layer(color, pattern)
         if index is None:
@@ -736,7 +853,7 @@ class add(
         else:
             if not (1 <= index <= len(layers)): raise UserError(f"Cannot insert before layer {self.layer}")
             layers.insert(index - 1, new_layer)
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await respond_with_banner(ctx, banner_designs[ctx.user.id])
 
 
@@ -768,7 +885,7 @@ class remove(
             else:
                 if not (1 <= index <= len(layers)): raise UserError(f"Cannot remove layer {self.layer}")
                 layers.pop(index - 1)
-            save_banner_data()
+            save_banner_data(ctx.user.id)
             await respond_with_banner(ctx, banner_designs[ctx.user.id])
 
 
@@ -787,13 +904,11 @@ class new(
 
     @lightbulb.invoke
     async def new(self, ctx: lightbulb.Context) -> None:
-        for color in Color:
-            if color.pretty_name == self.base_color:
-                break
-        else:
+        color = PRETTY_NAME_TO_COLOR.get(self.base_color)
+        if color is None:
             raise ValueError("Impossible")
         banner_designs[ctx.user.id] = Banner(color, [])
-        save_banner_data()
+        save_banner_data(ctx.user.id)
         await respond_with_banner(ctx, banner_designs[ctx.user.id])
 
 
@@ -832,24 +947,20 @@ class edit(
             else:
                 if not (1 <= index < len(layers)): raise UserError(f"Cannot edit layer {index}")
             if self.color:
-                for color in Color:
-                    if color.pretty_name == self.color:
-                        break
-                else:
+                color = PRETTY_NAME_TO_COLOR.get(self.color)
+                if color is None:
                     raise ValueError("Impossible")
             else:
                 color = layers[index].color
             if self.pattern:
-                for pattern in Pattern:
-                    if pattern.pretty_name == self.pattern:
-                        break
-                else:
+                pattern = PRETTY_NAME_TO_PATTERN.get(self.pattern)
+                if pattern is None:
                     raise ValueError(f"Invalid pattern: {self.pattern}")
             else:
                 pattern = layers[index].pattern
-            layers[index].set(Layer(color, pattern))
+            layers[index] = Layer(color, pattern)
             banner_designs[ctx.user.id] = Banner(layers[0].color, layers[1:])
-            save_banner_data()
+            save_banner_data(ctx.user.id)
             await respond_with_banner(ctx, banner_designs[ctx.user.id])
 
 
@@ -898,7 +1009,7 @@ class clear(
             )
         else:
             banner_designs[ctx.user.id].layers = []
-            save_banner_data()
+            save_banner_data(ctx.user.id)
             await respond_with_banner(ctx, banner_designs[ctx.user.id])
 
 async def layer_editing_menu(interaction: hikari.ComponentInteraction, prop: str, layer_no: int, page_no: int | None = None):
@@ -985,7 +1096,7 @@ async def banner_interaction(event: hikari.ComponentInteractionCreateEvent) -> N
     match prefix:
         case "clear":
             banner.layers = []
-            save_banner_data()
+            save_banner_data(user_id)
             await edit_for_banner(event.interaction, banner)
         case "new":
             await new_banner_menu(event.interaction)
@@ -993,7 +1104,7 @@ async def banner_interaction(event: hikari.ComponentInteractionCreateEvent) -> N
             base_color = Color(int(keywords[0]))
             banner = Banner(base_color)
             banner_designs[user_id] = banner
-            save_banner_data()
+            save_banner_data(user_id)
             await edit_for_banner(event.interaction, banner)
         case "select":
             await edit_for_banner(event.interaction, banner, selected=(int(keywords[0])))
@@ -1013,12 +1124,12 @@ async def banner_interaction(event: hikari.ComponentInteractionCreateEvent) -> N
                     banner.layers[:move_layer] + banner.layers[move_layer+1:move_to+1]
                     + [banner.layers[move_layer]] + banner.layers[move_to+1:]
                 )
-            save_banner_data()
+            save_banner_data(user_id)
             await edit_for_banner(event.interaction, banner)
         case "remove":
             layer_no = int(keywords[0])
             banner.layers.pop(layer_no-1)
-            save_banner_data()
+            save_banner_data(user_id)
             await edit_for_banner(event.interaction, banner)
         case "edit":
             layer_no = int(keywords[1])
@@ -1038,7 +1149,7 @@ async def banner_interaction(event: hikari.ComponentInteractionCreateEvent) -> N
                 banner.layers.append(new_layer)
             else:
                 banner.layers.insert(layer_no, new_layer)
-            save_banner_data()
+            save_banner_data(user_id)
             await edit_for_banner(event.interaction, banner)
         case "color" | "pattern":
             subprefix, *keywords = keywords
@@ -1047,10 +1158,10 @@ async def banner_interaction(event: hikari.ComponentInteractionCreateEvent) -> N
                 if prefix == "color" and layer_no == 0:
                     banner.base_color = Color(prop_id)
                 elif prefix == "color":
-                    banner.layers[layer_no-1].color = Color(prop_id)
+                    banner.layers[layer_no-1] = Layer(Color(prop_id), banner.layers[layer_no-1].pattern)
                 else:
-                    banner.layers[layer_no-1].pattern = Pattern(prop_id)
-                save_banner_data()
+                    banner.layers[layer_no-1] = Layer(banner.layers[layer_no-1].color, Pattern(prop_id))
+                save_banner_data(user_id)
                 await layer_editing_menu(event.interaction, prefix, layer_no)
             elif subprefix == "page":
                 page_no, button_prefix, *keywords = keywords
@@ -1076,6 +1187,31 @@ async def banner_interaction(event: hikari.ComponentInteractionCreateEvent) -> N
         case _: raise ValueError(f"Invalid button ID: {button_id}")
 
 
+patterns_catalog: tuple[str, bytes] | None = None
+
+def build_patterns_catalog() -> tuple[str, bytes]:
+    """The text listing and the encoded image of all patterns"""
+    output = []
+    output_banners = {}
+    for pattern in Pattern:
+        if pattern == Pattern.Banner:
+            banner = Banner(Color.Black, [])
+        else:
+            banner = Banner(Color.White, [Layer(Color.Black, pattern)])
+        output.append(pattern.pretty_name + " " + banner.text)
+        output_banners[pattern.pretty_name_no_char] = banner
+    return "\n".join(output), encode_png(banner_catalog_image(output_banners))
+
+async def get_patterns_catalog() -> tuple[str, bytes]:
+    global patterns_catalog
+    if patterns_catalog is None:
+        patterns_catalog = await RENDER_EXECUTOR.run(build_patterns_catalog)
+    return patterns_catalog
+
+@loader.listener(hikari.StartedEvent)
+async def on_started(_: hikari.StartedEvent) -> None:
+    await get_patterns_catalog()
+
 @banner_cmd_group.register
 class patterns(
     lightbulb.SlashCommand,
@@ -1084,43 +1220,34 @@ class patterns(
 ):
     @lightbulb.invoke
     async def patterns(self, ctx: lightbulb.Context) -> None:
-        output = []
-        output_images = {}
-        for pattern in Pattern:
-            if pattern == Pattern.Banner:
-                banner = Banner(Color.Black, [])
-            else:
-                banner = Banner(Color.White, [Layer(Color.Black, pattern)])
-            output.append(pattern.pretty_name + " " + banner.text)
-            output_images[pattern.pretty_name_no_char] = banner.image
-        columns = number_of_columns_for(len(output_images))
-        dummy_image = Image.new("RGBA", (1, 1))
-        dummy_draw = ImageDraw.Draw(dummy_image)
-        max_text_length = int(
-            max(dummy_draw.textlength(name, BASE_FONT) for name in output_images.keys())
-        )
-        image = Image.new(
-            "RGBA",
-            (
-                10 + (max_text_length + 40) * columns,
-                60 * ((len(output_images) + columns - 1) // columns),
-            ),
+        text, image = await get_patterns_catalog()
+        await ctx.respond(
+            text,
+            ephemeral = True,
+            attachment=hikari.Bytes(image, "patterns.png"),
         )
-        draw = ImageDraw.Draw(image)
-        for i, (name, banner) in enumerate(
-            sorted(list(output_images.items()), key=lambda x: x[0].lower())
-        ):
-            x = 10 + (max_text_length + 40) * (i % columns)
-            y = 10 + 60 * (i // columns)
-            image.paste(banner, (x, y))
-            draw.text((x + 30, y + 20), name, "#ffffff", BASE_FONT, anchor="lm")
-
-        async def callback(img):
-            await ctx.respond(
-                "\n".join(output),
-                ephemeral = True,
-                attachment=hikari.File(img),
-            )
 
-        await save_temporarily(callback, image)
 
+@loader.command
+class render_stats(
+    lightbulb.SlashCommand,
+    name="render-stats",
+    description="Show the banner rendering cache and render executor statistics",
+    default_member_permissions=hikari.Permissions.ADMINISTRATOR,
+):
+    @lightbulb.invoke
+    async def render_stats(self, ctx: lightbulb.Context) -> None:
+        caches = {
+            "Banner composites (pixels)": RENDER_CACHE,
+            "Scaled sprites (pixels)": SCALED_SPRITES,
+            "Banner PNGs (bytes)": BANNER_PNGS,
+            "Encoded images (bytes)": ENCODED_PNGS,
+        }
+        response = "### Render statistics"
+        for name, cache in caches.items():
+            response += f"\n- {name}: {len(cache)} items, {cache.size:,}/{cache.max_size:,} used. {cache.stats}"
+        response += f"\n- Render executor: {RENDER_EXECUTOR}"
+        response += f"\n- Render admission: {RENDER_ADMISSION}"
+        response += f"\n- Word splits: {SPLIT_STATS}"
+        response += f"\n- Banner data: {storage.loaded} users loaded, {len(storage.dirty)} unsaved, {storage.writes} writes"
+        await ctx.respond(response, ephemeral=True)
@@ -4,23 +4,32 @@ Admin messages
 Admin messages can be sent and edited through the bot by any administrator
 """
 
-from .utils.message import Message, Variable, message_json_decode_hook, MessageJSONEncoder
+from .utils.message import Message, Variable, VariableIndex, message_json_decode_hook, MessageJSONEncoder
 from .utils.paginator import PaginatorView
-from .utils.utils import UserError, handle_error, RED
+from .utils.server_status import ServerStatusPoller
+from .utils.edit_scheduler import EditScheduler
+from .utils.utils import META, UserError, handle_error, RED
 import json
 from json import JSONDecoder
+import logging
 import os
+from typing import Iterable
 import hikari, lightbulb, miru
 
-import requests
+import asyncio
 from asyncio import sleep
+from functools import partial
 from datetime import datetime, timezone
 
 loader = lightbulb.Loader()
+logger = logging.getLogger(__name__)
 
 messages: dict[str, Message] = {}
 variables: dict[str, Variable] = {}
-var_to_msg: dict[str, list[str]] = {}
+var_index = VariableIndex()
+# What was last sent to Discord, to skip edits that would change nothing
+rendered_texts: dict[str, str] = {}
+channel_names: dict[int, str] = {}
 
 if os.path.exists("messages.json"):
     with open("messages.json", encoding="utf-8") as f:
@@ -28,18 +37,26 @@ if os.path.exists("messages.json"):
     messages = {m.name: m for m in data["messages"]}
     variables = {v.name: v for v in data["variables"]}
 
-def update_var_to_msg():
-    global var_to_msg
-    var_to_msg = {}
-    for msg_name, msg in messages.items():
-        for var_name in msg.text.variables:
-            var_to_msg.setdefault(var_name, [])
-            var_to_msg[var_name].append(msg_name)
-    for var_name in list(variables.keys()):
-        if not var_name in var_to_msg:
-            del variables[var_name]
+for msg in messages.values():
+    var_index.set_message(msg.name, msg.text.variables)
+for var_name in list(variables.keys()):
+    if var_name not in var_index:
+        del variables[var_name]
 
-update_var_to_msg()
+def link_message(msg: Message):
+    """Index the variables of the message text, creating the new ones and deleting those no message uses anymore"""
+    for var_name in var_index.set_message(msg.name, msg.text.variables):
+        variables.pop(var_name, None)
+    for var_name in msg.text.variables:
+        if var_name not in variables:
+            variables[var_name] = Variable(var_name)
+
+def forget_message(name: str):
+    """Stop tracking the message, deleting the variables no other message uses"""
+    messages.pop(name, None)
+    rendered_texts.pop(name, None)
+    for var_name in var_index.remove_message(name):
+        variables.pop(var_name, None)
 
 def save_message_data():
     with open("messages.json", "w") as f:
@@ -47,35 +64,48 @@ def save_message_data():
             "messages": list(messages.values()),
             "variables": list(variables.values())
         }, f, cls = MessageJSONEncoder, indent = 4)
-    update_var_to_msg()
+
+async def refresh_message(rest: hikari.api.RESTClient, msg: Message) -> bool:
+    """Edit the message to its text with the current variable values, unless that is what it already shows"""
+    if messages.get(msg.name) is not msg: return False
+    text = msg.text.render(variables)
+    if rendered_texts.get(msg.name) == text: return False
+    await rest.edit_message(msg.channel_id, msg.id, text)
+    rendered_texts[msg.name] = text
+    return True
 
 @loader.listener(hikari.StartedEvent)
 async def on_starting(event: hikari.StartedEvent) -> None:
-    for name, msg in messages.items():
-        try: await event.app.rest.fetch_message(msg.channel_id, msg.id)
-        except hikari.NotFoundError: del messages[name]
-        save_message_data()
+    for name, msg in list(messages.items()):
+        try: rendered_texts[name] = (await event.app.rest.fetch_message(msg.channel_id, msg.id)).content
+        except hikari.NotFoundError: forget_message(name)
+    save_message_data()
 
 CHARACTER_LIMIT = 2000
 
-metadata_path = os.path.join("meta.json")
-if os.path.exists(metadata_path):
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        GUILD_ID: int = data["Guild ID"]
-        # WELCOME_CHANNEL: hikari.GuildChannel = data["Welcome channel ID"]
-        # WELCOME_MESSAGE: str = data["Welcome message"]
-        # NO_TEXT_CATEGORIES: List[int] = data["No-text categories"]
-        SERVER_RESTART_HOUR: int = data["Server restart hour"]
-        SERVER_RESTART_MINUTE: int = data["Server restart minute"]
-        MAX_EMOJIS: int = data["Max custom emojis"]
-        EMOJIS_PER_MESSAGE: int = data["Emojis per message"]
-        PROTECTED_EMOJIS: int = data["Emojis protected by vote"]
-else:
-    raise FileNotFoundError("meta.json is missing.\n"
-                            "If you cloned or pulled the git repo, "
-                            "make sure to copy example.meta.json, "
-                            "name it meta.json and edit for your needs.")
+GUILD_ID: int = META["Guild ID"]
+SERVER_RESTART_HOUR: int = META["Server restart hour"]
+SERVER_RESTART_MINUTE: int = META["Server restart minute"]
+MAX_EMOJIS: int = META["Max custom emojis"]
+EMOJIS_PER_MESSAGE: int = META["Emojis per message"]
+PROTECTED_EMOJIS: int = META["Emojis protected by vote"]
+SERVER_STATUS_URL: str = META.get("Server status URL", "https://api.mcsrvstat.us/3/{address}")
+SERVER_STATUS_TIMEOUT: float = META.get("Server status timeout seconds", 10)
+SERVER_STATUS_RETRIES: int = META.get("Server status retries", 2)
+EDIT_CHANNEL_CONCURRENCY: int = META.get("Edit channel concurrency", 4)
+
+edit_scheduler = EditScheduler(EDIT_CHANNEL_CONCURRENCY)
+
+def schedule_refresh(rest: hikari.api.RESTClient, msg_names: Iterable[str]) -> list[asyncio.Future[bool]]:
+    """Refresh the messages in the background, rendering each with the variable values at the time it is edited"""
+    return [
+        edit_scheduler.schedule(msg.channel_id, msg.id, partial(refresh_message, rest, msg))
+        for msg in (messages[msg_name] for msg_name in msg_names)
+    ]
+
+def stale_messages() -> list[str]:
+    """The messages that do not show their current text, such as those whose last edit failed"""
+    return [name for name, msg in messages.items() if rendered_texts.get(name) != msg.text.render(variables)]
 
 async def process_emoji_vote(message: hikari.Message):
     if "emoji_vote" not in messages:
@@ -166,7 +196,7 @@ async def on_message_create(event: hikari.MessageCreateEvent) -> None:
 async def on_message_delete(event: hikari.MessageDeleteEvent) -> None:
     for name, msg in messages.items():
         if msg.channel_id == event.channel_id and msg.id == event.message_id:
-            del messages[name]
+            forget_message(name)
             save_message_data()
             return
 
@@ -264,13 +294,16 @@ async def create_message(channel: hikari.TextableChannel, name: str, text: str,
     if len(text) > CHARACTER_LIMIT:
         raise UserError(f"The message length cannot exceed {CHARACTER_LIMIT} characters")
     msg = Message(name, text, channel.id, og_author=user_id)
-    for var in msg.text.variables:
-        if var not in variables:
-            variables[var] = Variable(var)
-    text = msg.text.with_values(**variables)
-    message = await channel.app.rest.create_message(channel, text)
+    link_message(msg)
+    text = msg.text.render(variables)
+    try:
+        message = await channel.app.rest.create_message(channel, text)
+    except:
+        forget_message(name)
+        raise
     msg.id = message.id
     messages[name] = msg
+    rendered_texts[name] = text
     save_message_data()
     return f"New message `{msg.name}` created: {msg.url(GUILD_ID)}"
 
@@ -342,11 +375,9 @@ async def edit_message(bot: lightbulb.Client, name: str, text: str, user_id: int
     msg = messages[name]
     msg.text = text
     msg.last_editor = user_id
-    for var_name in msg.text.variables:
-        if var_name not in variables:
-            variables[var_name] = Variable(var_name)
+    link_message(msg)
     save_message_data()
-    await bot.rest.edit_message(msg.channel_id, msg.id, msg.text.with_values(**variables))
+    await refresh_message(bot.rest, msg)
     return f"Edited message `{msg.name}` {msg.url(GUILD_ID)}"
 
 message_editing_processes: dict[int, str] = {}
@@ -413,7 +444,8 @@ class message_unlink(
 
     @lightbulb.invoke
     async def message_unlink(self, ctx: lightbulb.Context) -> None:
-        msg =  messages.pop(self.name)
+        msg =  messages[self.name]
+        forget_message(self.name)
         save_message_data()
         await ctx.respond(f"Unlinked message `{msg.name}` {msg.url(GUILD_ID)}", ephemeral=True)
 
@@ -432,7 +464,7 @@ class message_delete(
     async def message_delete(self, ctx: lightbulb.Context) -> None:
         msg = messages[self.name]
         await ctx.client.rest.delete_message(msg.channel_id, msg.id, reason=f"Deleted by admin <@{ctx.user.id}>")
-        del messages[self.name]
+        forget_message(self.name)
         save_message_data()
         await ctx.respond(f"Deleted message `{msg.name}`", ephemeral=True)
 
@@ -539,15 +571,23 @@ class variable_set(
         await ctx.defer(ephemeral=True)
         var = variables[self.name]
         var.value = self.value
-        for msg_name in var_to_msg[var.name]:
-            msg = messages[msg_name]
-            await ctx.client.rest.edit_message(msg.channel_id, msg.id, msg.text.with_values(**variables))
         save_message_data()
+        edits = schedule_refresh(ctx.client.rest, var_index.messages(var.name))
         response = f"Set variable value: {var}"
-        if self.name in var_to_msg:
-            msg_count = len(var_to_msg[self.name])
+        if not edits:
+            await ctx.respond(response, ephemeral=True)
+            return
+        msg_count = len(edits)
+        response_id = await ctx.respond(
+            response + ("\nUpdating 1 message..." if msg_count == 1 else f"\nUpdating {msg_count} messages..."),
+            ephemeral=True
+        )
+        updated = sum(await asyncio.gather(*edits))
+        if updated == msg_count:
             response += "\n1 message was updated" if msg_count == 1 else f"\n{msg_count} messages were updated"
-        await ctx.respond(response, ephemeral=True)
+        else:
+            response += f"\n{updated} of {msg_count} messages were updated. Last error: {edit_scheduler.last_error}"
+        await ctx.edit_response(response_id, response)
 
 
 @variable_cmd_subgroup.register
@@ -572,17 +612,26 @@ class variable_list(
 
 UPDATE_TIME_MINS = 1
 
+status_poller = ServerStatusPoller(SERVER_STATUS_URL, SERVER_STATUS_TIMEOUT, SERVER_STATUS_RETRIES, backoff=1)
+
+@loader.listener(hikari.StoppingEvent)
+async def on_stopping(_: hikari.StoppingEvent) -> None:
+    await status_poller.close()
+
 @loader.task(lightbulb.uniformtrigger(seconds=UPDATE_TIME_MINS*60), True, -1, -1)
-async def update_server_status(bot: hikari.GatewayBot) -> None:
-    for key in variables:
-        if key.startswith("ip"):
-            name = key[2:]
-            await update_server_status(bot, name)
+async def update_server_statuses(bot: hikari.GatewayBot) -> None:
+    addresses = {key[2:]: var.value for key, var in variables.items() if key.startswith("ip")}
+    statuses = await status_poller.fetch_all(addresses)
+    for name, resp in statuses.items():
+        # A server whose status could not be fetched keeps its last status until the next update
+        if isinstance(resp, BaseException):
+            logger.warning("Could not fetch the status of %s (%s): %r", name, addresses[name], resp)
+            continue
+        await update_server_status(bot, name, resp)
+    # Retry the edits that failed since the last update
+    schedule_refresh(bot.rest, stale_messages())
 
-async def update_server_status(bot: hikari.GatewayBot, name: str):
-    # Get server ip
-    address = variables[f"ip{name}"].value
-    resp = requests.get(f"https://api.mcsrvstat.us/3/{address}").json()
+async def update_server_status(bot: hikari.GatewayBot, name: str, resp: dict):
 
     # Check current time against server restart time
     # This is because the server may restart fast enough for the 1-minute interval to miss it,
@@ -610,19 +659,19 @@ async def update_server_status(bot: hikari.GatewayBot, name: str):
                       f"status{name}_uptime_minutes": uptime_minutes, f"status{name}_uptime_hours": uptime_hours,
                       f"status{name}_player_list": player_list}
     messages_to_update = set()
-    for key in vars_to_update:
-        if key in variables:
-            var = variables[key]
-            var.value = str(vars_to_update[key])
-            for msg_name in var_to_msg[var.name]:
-                messages_to_update.add(msg_name)
-    for msg_name in messages_to_update:
-        msg = messages[msg_name]
-        await bot.rest.edit_message(msg.channel_id, msg.id, msg.text.with_values(**variables))
-    save_message_data()
+    for key, value in vars_to_update.items():
+        var = variables.get(key)
+        if var is None or var.value == str(value): continue
+        var.value = str(value)
+        messages_to_update.update(var_index.messages(var.name))
+    if messages_to_update:
+        schedule_refresh(bot.rest, messages_to_update)
+        save_message_data()
     # Update status channel
     if f"status{name}" in messages:
-        await sleep(1)
         msg = messages[f"status{name}"]
         status_channel_name = f"🟢-{player_count}-player{player_count_pluralizer}-online" if online else "🔴-server-offline"
-        await bot.rest.edit_channel(msg.channel_id,name=status_channel_name)
+        if channel_names.get(msg.channel_id) != status_channel_name:
+            await sleep(1)
+            await bot.rest.edit_channel(msg.channel_id,name=status_channel_name)
+            channel_names[msg.channel_id] = status_channel_name
@@ -1,22 +1,13 @@
-import json
-import os
+from .utils.utils import META
 import re
 import hikari, lightbulb
 
 loader = lightbulb.Loader()
 
-if os.path.exists("meta.json"):
-    with open("meta.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-        WELCOME_CHANNEL: hikari.GuildChannel = data["Welcome channel ID"]
-        WELCOME_MESSAGE: str = data["Welcome message"]
-        NO_TEXT_CATEGORIES: list[int] = data["No-text categories"]
-        SCHEDULING_CHANNELS: list[int] = data["Scheduling channels"]
-else:
-    raise FileNotFoundError("meta.json is missing.\n"
-                            "If you cloned or pulled the git repo, "
-                            "make sure to copy example.meta.json, "
-                            "name it meta.json and edit for your needs.")
+WELCOME_CHANNEL: hikari.GuildChannel = META["Welcome channel ID"]
+WELCOME_MESSAGE: str = META["Welcome message"]
+NO_TEXT_CATEGORIES: list[int] = META["No-text categories"]
+SCHEDULING_CHANNELS: list[int] = META["Scheduling channels"]
 
 @loader.listener(hikari.MemberCreateEvent)
 async def on_join(event: hikari.MemberCreateEvent) -> None:
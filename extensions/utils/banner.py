@@ -3,12 +3,15 @@ import hikari
 import lightbulb
 import inspect
 from json import JSONEncoder
+import numpy as np
 from PIL import Image
 import re
-from .splitting import SplitMode
+from .splitting import SplitMode, NameIndex
+import struct
 import sys
-from typing import List, Dict, Any
-from .utils import urlize, save_temporarily
+from typing import List, Dict, Any, Callable, Iterator
+from .utils import urlize, LRUCache
+from .rendering import RENDER_EXECUTOR, RENDER_ADMISSION, encode_png, encode_png_bands
 
 PATTERNS_COUNT = 42
 COLORS_COUNT = 16
@@ -20,6 +23,166 @@ for r in range(PATTERNS_COUNT+1):
     for c in range(COLORS_COUNT):
         row.append(BANNER_SPRITESHEET.crop((c * 40, r * 40, c * 40 + 20, r * 40 + 40)))
     SPRITES.append(row)
+# Shape: (patterns + 1, colors, 40, 20, 4). The extra last row is transparent, for padding
+SPRITE_ATLAS = np.stack([np.stack([np.asarray(sprite) for sprite in row]) for row in SPRITES]
+                        + [np.zeros((COLORS_COUNT, 40, 20, 4), dtype=np.uint8)])
+
+SCALED_SPRITES_CACHE_PIXELS = 8_000_000
+SCALED_SPRITES: LRUCache[tuple[int, int, int], Image.Image] = LRUCache(
+    SCALED_SPRITES_CACHE_PIXELS, size_of = lambda image: image.width * image.height
+)
+
+def scaled_sprite(pattern_index: int, color_index: int, scale: int = 1) -> Image.Image:
+    """
+    The sprite of the pattern (by `Pattern.value`) and color (by `Color.unicode_index`) upscaled to `scale` times its size.
+    Sprites of each scale are upscaled once when first needed.
+    The returned image is shared with the cache and must not be modified
+    """
+    sprite = SPRITES[pattern_index][color_index]
+    if scale == 1: return sprite
+    key = (pattern_index, color_index, scale)
+    scaled = SCALED_SPRITES.get(key)
+    if scaled is None:
+        scaled = sprite.resize((20 * scale, 40 * scale), Image.Resampling.NEAREST)
+        SCALED_SPRITES.put(key, scaled)
+    return scaled
+
+RENDER_CACHE_PIXELS = 4_000_000
+RENDER_CACHE: LRUCache[tuple[bytes, int], Image.Image] = LRUCache(
+    RENDER_CACHE_PIXELS, size_of = lambda image: image.width * image.height
+)
+
+def render_layers(layers: bytes, scale: int = 1) -> Image.Image:
+    """
+    Composite the layers (base layer included, packed as in `Banner.key`) at `scale` times the texture size,
+    reusing the composites of their prefixes.
+    The returned image is shared with the cache and must not be modified
+    """
+    image = RENDER_CACHE.get((layers, scale))
+    if image is not None: return image
+    prefix, pattern_index, color_index = layers[:-2], layers[-2], layers[-1]
+    image = render_layers(prefix, scale).copy() if prefix else Image.new("RGBA", (20 * scale, 40 * scale))
+    image.alpha_composite(scaled_sprite(pattern_index, color_index, scale))
+    RENDER_CACHE.put((layers, scale), image)
+    return image
+
+def __alpha_composite_tables() -> tuple[np.ndarray, np.ndarray]:
+    # Pillow's alpha_composite blending coefficients only depend on the source and destination alpha,
+    # so they are computed once for every pair, with the same integer rounding (and 7 extra bits of precision).
+    # Indexed by src_alpha * 256 + dst_alpha
+    src_a, dst_a = np.meshgrid(np.arange(256, dtype=np.uint32), np.arange(256, dtype=np.uint32), indexing="ij")
+    out_a255 = src_a * 255 + dst_a * (255 - src_a)
+    coef_src = src_a * (255 * 255 << 7) // np.maximum(out_a255, 1)
+    out_a = out_a255 + 0x80
+    out_a = ((out_a >> 8) + out_a) >> 8
+    return coef_src.ravel(), out_a.astype(np.uint8).ravel()
+
+ALPHA_COMPOSITE_COEFFICIENTS, ALPHA_COMPOSITE_ALPHA = __alpha_composite_tables()
+
+def alpha_composite_arrays(dst: np.ndarray, src: np.ndarray) -> np.ndarray:
+    """`Image.alpha_composite` over arrays of RGBA pixels, giving exactly the same result as Pillow"""
+    alphas = src[..., 3].astype(np.intp) * 256 + dst[..., 3]
+    coef_dst = (255 << 7) - ALPHA_COMPOSITE_COEFFICIENTS.take(alphas)[..., None]
+    src_rgb = src[..., :3].astype(np.uint32)
+    # src * coef_src + dst * coef_dst, where coef_src + coef_dst = 255 << 7
+    rgb = dst[..., :3].astype(np.uint32)
+    rgb -= src_rgb
+    rgb *= coef_dst
+    rgb += src_rgb * (255 << 7) + (0x80 << 7)
+    rgb = (((rgb >> 8) + rgb) >> 8) >> 7
+    output = np.empty_like(dst)
+    output[..., :3] = rgb
+    output[..., 3] = ALPHA_COMPOSITE_ALPHA.take(alphas)
+    return output
+
+def render_banner_array(banners: List["Banner"]) -> np.ndarray:
+    """Composite all the banners at once. Returns an array of shape (banners, 40, 20, 4)"""
+    max_layers = max((len(banner.layers) + 1 for banner in banners), default=1)
+    patterns = np.full((len(banners), max_layers), len(SPRITES), dtype=np.intp)
+    colors = np.zeros((len(banners), max_layers), dtype=np.intp)
+    for i, banner in enumerate(banners):
+        key = np.frombuffer(banner.key, dtype=np.uint8)
+        patterns[i, :len(key) // 2] = key[0::2]
+        colors[i, :len(key) // 2] = key[1::2]
+    sprites = SPRITE_ATLAS[patterns, colors] # Shape: (banners, layers, 40, 20, 4)
+    output = np.zeros((len(banners), 40, 20, 4), dtype=np.uint8)
+    for j in range(max_layers):
+        output = alpha_composite_arrays(output, sprites[:, j])
+    return output
+
+class BannerGrid:
+    """
+    Lines of banners laid out in an image. The distinct banners are composited in one batch up front,
+    but the image itself is only produced in bands of one row of banners, see `bands` and `render_png`
+    """
+    def __init__(self, lines: List[List["Banner | None"]], writing_direction: Direction, newline_direction: Direction,
+                 scale: int, margin: int, spacing: int):
+        self.scale = scale
+        self.margin = margin
+        self.spacing = spacing
+        self.rows, self.cols = grid_shape(lines, writing_direction)
+        self.width, self.height = grid_size(self.rows, self.cols, scale, margin, spacing)
+        row_length = max(map(len, lines))
+        line_indices, word_indices = np.meshgrid(np.arange(len(lines)), np.arange(row_length), indexing="ij")
+        rows = cols = None
+        for direction, indices in ((newline_direction, line_indices), (writing_direction, word_indices)):
+            if direction == Direction.Up: rows = self.rows - indices - 1
+            elif direction == Direction.Down: rows = indices
+            elif direction == Direction.Left: cols = self.cols - indices - 1
+            elif direction == Direction.Right: cols = indices
+            else: raise ValueError(f"Invalid direction: {direction}")
+
+        # Render each distinct banner once
+        distinct: dict[bytes, Banner] = {}
+        for line in lines:
+            for banner in line:
+                if banner: distinct.setdefault(banner.key, banner)
+        self.tiles = render_banner_array(list(distinct.values()))
+        tile_indices = {key: i for i, key in enumerate(distinct)}
+        self.cells = np.full((self.rows, self.cols), -1, dtype=np.intp)
+        for line, line_rows, line_cols in zip(lines, rows, cols):
+            for banner, row, col in zip(line, line_rows, line_cols):
+                if banner: self.cells[row, col] = tile_indices[banner.key]
+
+    def bands(self) -> Iterator[np.ndarray]:
+        """The image from top to bottom, in bands of rows of shape (height, width, 4)"""
+        scale = self.scale
+        # Margins and spacing are yielded in slices of one band at most, however large they are
+        blank = np.zeros((40 * scale, self.width, 4), dtype=np.uint8)
+        def blank_rows(count: int) -> Iterator[np.ndarray]:
+            for start in range(0, count, len(blank)):
+                yield blank[:min(len(blank), count - start)]
+
+        yield from blank_rows(self.margin)
+        for row in range(self.rows):
+            if row > 0: yield from blank_rows(self.spacing)
+            band = np.zeros((40 * scale, self.width, 4), dtype=np.uint8)
+            for col, tile in enumerate(self.cells[row]):
+                if tile < 0: continue
+                x = col * 20 * scale + self.margin + self.spacing * col
+                band[:, x:x + 20 * scale] = self.tiles[tile].repeat(scale, axis=0).repeat(scale, axis=1)
+            yield band
+        yield from blank_rows(self.margin)
+
+    def render_png(self) -> bytes:
+        return encode_png_bands(self.width, self.height, self.bands())
+
+def render_banner_grid_png(lines: List[List["Banner | None"]], writing_direction: Direction,
+                           newline_direction: Direction, scale: int, margin: int, spacing: int) -> bytes:
+    return BannerGrid(lines, writing_direction, newline_direction, scale, margin, spacing).render_png()
+
+def grid_shape(lines: List[List["Banner | None"]], writing_direction: Direction) -> tuple[int, int]:
+    """The number of rows and columns of banners in the image"""
+    rows, cols = len(lines), max(map(len, lines))
+    if writing_direction.value % 2 == 0: rows, cols = cols, rows
+    return rows, cols
+
+def grid_size(rows: int, cols: int, scale: int, margin: int, spacing: int) -> tuple[int, int]:
+    """The width and height of the image of a grid of banners"""
+    return (
+        cols * 20 * scale + margin * 2 + spacing * (cols - 1),
+        rows * 40 * scale + margin * 2 + spacing * (rows - 1),
+    )
 
 async def pattern_autocomplete(ctx: lightbulb.AutocompleteContext[str]) -> None:
     output = []
@@ -30,16 +193,41 @@ async def pattern_autocomplete(ctx: lightbulb.AutocompleteContext[str]) -> None:
     return
 
 class Layer:
-    def __init__(self, color: Color, pattern: Pattern):
-        self.color = color
-        self.pattern = pattern
+    """
+    A pattern in a color. Layers are immutable, and there is only one instance of each,
+    so they take no memory per banner and compare by identity
+    """
+    __slots__ = ("color", "pattern", "key", "character", "banner_code")
+    __instances: dict[tuple[Color, Pattern], "Layer"] = {}
+
+    color: Color
+    pattern: Pattern
+    key: bytes
+    character: str
+    banner_code: str
+
+    def __new__(cls, color: Color, pattern: Pattern) -> "Layer":
+        layer = cls.__instances.get((color, pattern))
+        if layer is None:
+            layer = super().__new__(cls)
+            for name, value in (
+                ("color", color),
+                ("pattern", pattern),
+                ("key", bytes((pattern.value, color.unicode_index))),
+                ("character", chr(0xE000 + 0x100 * color.unicode_index + int(str(pattern.value), base = 16))),
+                ("banner_code", pattern.data_value + str(color.value)),
+            ):
+                object.__setattr__(layer, name, value)
+            cls.__instances[(color, pattern)] = layer
+        return layer
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError("Layers are immutable, replace the layer instead")
+
+    def __reduce__(self): return Layer, (self.color, self.pattern)
 
     def __repr__(self) -> str: return f"Layer[{self.color.name} {self.pattern.name}]"
 
-    @property
-    def character(self) -> str:
-        return chr(0xE000 + 0x100 * self.color.unicode_index + int(str(self.pattern.value), base = 16))
-
     @property
     def base_text(self) -> str:
         if self.pattern == Pattern.Banner: return ""
@@ -53,78 +241,107 @@ class Layer:
     def sprite(self) -> Image.Image:
         return SPRITES[self.pattern.value][self.color.unicode_index]
 
-    @property
-    def banner_code(self) -> str:
-        return self.pattern.data_value + str(self.color.value)
-
     @property
     def planetminecraft_url_part(self) -> str:
         return self.color.planetminecraft_url_index + self.pattern.planetminecraft_url_index
 
     @classmethod
     def from_character(cls, char: str) -> "Layer":
+        layer = LAYERS_BY_CHARACTER.get(char)
+        if layer is not None: return layer
         value = ord(char)
         assert 0xE000 <= value < 0xF000, f"Character U+{hex(value)[2:].zfill(4)} is out of range"
-        value -= 0xE000
-        pattern_index = int(hex(value % 0x100)[2:])
-        for pattern in Pattern:
-            if pattern.value == pattern_index: break
-        else: raise ValueError(f"No pattern indexed with {pattern_index}")
-        color_index = value // 0x100
-        for color in Color:
-            if color.unicode_index == color_index: break
-        else: raise ValueError("What the heck? HOW?? This shouldn't be reachable!")
-        return cls(color, pattern)
+        raise ValueError(f"No pattern indexed with {hex((value - 0xE000) % 0x100)[2:]}")
 
     @classmethod
     def from_banner_code_part(cls, part: str) -> "Layer":
-        r = re.compile(r"([a-z]+)(\d+)")
-        match = r.fullmatch(part)
+        match = BANNER_CODE_PART_REGEX.fullmatch(part)
         assert match, f"Invalid code part: {part}"
         pattern_part, color_part = match.groups()
-        for pattern in Pattern:
-            if pattern.data_value == pattern_part: break
-        else: raise ValueError(f"Invalid pattern: {pattern_part}")
-        for color in Color:
-            if str(color.value) == color_part: break
-        else: raise ValueError(f"Invalid color: {color_part}")
+        pattern = DATA_VALUE_TO_PATTERN.get(pattern_part)
+        if pattern is None: raise ValueError(f"Invalid pattern: {pattern_part}")
+        color = BANNER_CODE_TO_COLOR.get(color_part)
+        if color is None: raise ValueError(f"Invalid color: {color_part}")
         return Layer(color, pattern)
 
     @classmethod
     def from_planetminecraft_url_part(cls, part: str) -> "Layer":
         assert len(part) == 2, f"Invalid URL part: {part}"
         color_char, pattern_char = part
-        for color in Color:
-            if color.planetminecraft_url_index == color_char: break
-        else: raise ValueError(f"Invalid color: {color_char}")
-        for pattern in Pattern:
-            if pattern.planetminecraft_url_index == pattern_char: break
-        else: raise ValueError(f"Invalid pattern: {pattern_char}")
+        color = PLANETMINECRAFT_URL_INDEX_TO_COLOR.get(color_char)
+        if color is None: raise ValueError(f"Invalid color: {color_char}")
+        pattern = PLANETMINECRAFT_URL_INDEX_TO_PATTERN.get(pattern_char)
+        if pattern is None: raise ValueError(f"Invalid pattern: {pattern_char}")
         return Layer(color, pattern)
 
-    def copy(self) -> "Layer":
-        return Layer(self.color, self.pattern)
-
-    def set(self, other: "Layer") -> None:
-        self.color = other.color
-        self.pattern = other.pattern
+LAYERS_BY_CHARACTER = {layer.character: layer for layer in (Layer(color, pattern) for color in Color for pattern in Pattern)}
+LAYERS_BY_KEY = {layer.key: layer for layer in LAYERS_BY_CHARACTER.values()}
+BANNER_TEXT_CHARACTERS = frozenset({"\U000CFFF7"} | set(chr(c) for c in range(0xE000, 0xF000)))
+BANNER_CODE_PART_REGEX = re.compile(r"([a-z]+)(\d+)")
+BANNER_CODE_REGEX = re.compile(r"[a-z\d]+")
+BANNER_CODE_PARTS_REGEX = re.compile(r"([a-z]+\d+)")
+
+BANNERWRITER_URL_PREFIX = "https://banner-writer.web.app/image/"
+BANNERWRITER_SPACE = "_"
+BANNERWRITER_NEWLINE = "~"
+
+def __bannerwriter_token_table() -> list[Color | Pattern | str | None]:
+    table: list[Color | Pattern | str | None] = [None] * 128
+    for char, color in BANNERWRITER_URL_INDEX_TO_COLOR.items(): table[ord(char)] = color
+    for char, pattern in BANNERWRITER_URL_INDEX_TO_PATTERN.items(): table[ord(char)] = pattern
+    table[ord(BANNERWRITER_SPACE)] = BANNERWRITER_SPACE
+    table[ord(BANNERWRITER_NEWLINE)] = BANNERWRITER_NEWLINE
+    return table
+
+BANNERWRITER_TOKENS = __bannerwriter_token_table()
+
+def bannerwriter_tokens(bannerwriter_url: str) -> Iterator[Layer | str]:
+    """
+    Read a bannerwriter image URL in one pass, giving its layers, `BANNERWRITER_SPACE` and `BANNERWRITER_NEWLINE`.
+    A color character sets the color of the patterns after it, and is white until the first one
+    """
+    assert bannerwriter_url.startswith(BANNERWRITER_URL_PREFIX), \
+        f"Not a bannerwriter URL: {bannerwriter_url}"
+    assert len(bannerwriter_url) > len(BANNERWRITER_URL_PREFIX) and bannerwriter_url[len(BANNERWRITER_URL_PREFIX)] in "LR", \
+        f"Bannerwriter URL didn't have a direction control character: {bannerwriter_url}"
+    assert bannerwriter_url.endswith(".png"), \
+        f"Bannerwriter URL didn't end with a .png extension: {bannerwriter_url}"
+    current_color = Color.White
+    for char in bannerwriter_url[len(BANNERWRITER_URL_PREFIX) + 1:-4]:
+        token = BANNERWRITER_TOKENS[ord(char)] if ord(char) < 128 else None
+        if isinstance(token, Color):
+            current_color = token
+        elif isinstance(token, Pattern):
+            yield Layer(current_color, token)
+        elif token is not None:
+            yield token
+        else:
+            raise ValueError(f"Invalid character detected: {char}")
 
 class Banner:
-    def __init__(self, base_color: Color, layers: List[Layer] = []):
+    __slots__ = ("base_color", "layers")
+
+    def __init__(self, base_color: Color, layers: List[Layer] | None = None):
         self.base_color = base_color
-        self.layers = layers
+        self.layers = layers if layers is not None else []
 
     @property
     def all_layers(self) -> List[Layer]: return [Layer(self.base_color, Pattern.Banner)] + self.layers
 
     def __repr__(self) -> str: return f"Banner[{', '.join(repr(layer) for layer in self.all_layers)}]"
 
+    @property
+    def key(self) -> bytes:
+        """The layers, base layer included, packed as (pattern, color) byte pairs. Hashable and cheap to compare"""
+        return b"".join([Layer(self.base_color, Pattern.Banner).key] + [layer.key for layer in self.layers])
+
     @property
     def image(self) -> Image.Image:
-        output = Image.new("RGBA", (20, 40))
-        for layer in self.all_layers:
-            output.alpha_composite(layer.sprite)
-        return output
+        return self.render().copy()
+
+    def render(self, scale: int = 1) -> Image.Image:
+        """The banner image at `scale` times the texture size. The returned image must not be modified"""
+        return render_layers(self.key, scale)
 
     @property
     def text(self) -> str:
@@ -141,16 +358,23 @@ class Banner:
 
     @classmethod
     def from_text(cls, text: str) -> "Banner":
-        assert set(text) <= {"\U000CFFF7"} | set(chr(c) for c in range(0xE000, 0xF000)), "Please use banner text"
+        assert set(text) <= BANNER_TEXT_CHARACTERS, "Please use banner text"
         assert set(text[1::2]) == {"\U000CFFF7"}, "Only one banner should be provided"
         all_layers = [Layer.from_character(c) for c in text[::2]]
         assert all_layers[0].pattern == Pattern.Banner, "The banner should start with a full pattern"
         return cls(all_layers[0].color, all_layers[1:])
 
+    @classmethod
+    def from_key(cls, key: bytes) -> "Banner":
+        all_layers = [LAYERS_BY_KEY.get(key[i:i + 2]) for i in range(0, len(key), 2)]
+        assert all_layers and None not in all_layers, f"Invalid banner key: {key.hex()}"
+        assert all_layers[0].pattern == Pattern.Banner, "The banner should start with a full pattern"
+        return cls(all_layers[0].color, all_layers[1:])
+
     @classmethod
     def from_banner_code(cls, banner_code: str) -> "Banner":
-        assert re.compile(r"[a-z\d]+").fullmatch(banner_code), f"Invalid banner code: {banner_code}"
-        parts = re.compile(r"([a-z]+\d+)").sub(r"\1,", banner_code).split(",")[:-1]
+        assert BANNER_CODE_REGEX.fullmatch(banner_code), f"Invalid banner code: {banner_code}"
+        parts = BANNER_CODE_PARTS_REGEX.sub(r"\1,", banner_code).split(",")[:-1]
         all_layers = [Layer.from_banner_code_part(part) for part in parts]
         assert all_layers, f"Invalid banner code: {banner_code}"
         assert all_layers[0].pattern == Pattern.Banner, "The banner should start with a full pattern"
@@ -158,29 +382,11 @@ class Banner:
 
     @classmethod
     def from_bannerwriter_url(cls, bannerwriter_url: str) -> "Banner":
-        assert bannerwriter_url.startswith("https://banner-writer.web.app/image/"), \
-            f"Not a bannerwriter URL: {bannerwriter_url}"
-        assert len(bannerwriter_url) >= 37 and bannerwriter_url[36] == "L" or bannerwriter_url[36] == "R", \
-            f"Bannerwriter URL didn't have a direction control character: {bannerwriter_url[36]}"
-        assert bannerwriter_url.endswith(".png"), \
-            f"Bannerwriter URL didn't end with a .png extension: {bannerwriter_url}"
-        bannerwriter_url = bannerwriter_url[37:-4]
-        current_color = Color.White # Color is changed only when required in this URL type. Default is white.
         layers = []
-        for char in bannerwriter_url:
-            for color in Color:
-                if color.bannerwriter_url_index == char:
-                    current_color = color
-                    break
-            else:
-                for pattern in Pattern:
-                    if pattern.bannerwriter_url_index == char:
-                        layers.append(Layer(current_color, pattern))
-                        break
-                else:
-                    if char == "_" or char == "~":
-                        raise ValueError(f"Bannerwriter URL contained space/newline: {bannerwriter_url}")
-                    raise ValueError(f"Invalid character detected: {char}")
+        for token in bannerwriter_tokens(bannerwriter_url):
+            if token == BANNERWRITER_SPACE or token == BANNERWRITER_NEWLINE:
+                raise ValueError(f"Bannerwriter URL contained space/newline: {bannerwriter_url}")
+            layers.append(token)
         assert len(layers) > 0, \
             f"Banner from Bannerwriter URL was empty: {bannerwriter_url}"
         background = layers.pop(0)
@@ -190,50 +396,28 @@ class Banner:
             assert layer.pattern != Pattern.Banner, \
                 f"Bannerwriter URL contained multiple banners: {bannerwriter_url}"
         return cls(background.color, layers)
-    
+
     @classmethod
     def from_bannerwriter_url_multi(cls, bannerwriter_url: str) -> List[List["Banner"]]:
-        assert bannerwriter_url.startswith("https://banner-writer.web.app/image/"), \
-            f"Not a bannerwriter URL: {bannerwriter_url}"
-        assert len(bannerwriter_url) >= 37 and bannerwriter_url[36] == "L" or bannerwriter_url[36] == "R", \
-            f"Bannerwriter URL didn't have a direction control character: {bannerwriter_url[36]}"
-        assert bannerwriter_url.endswith(".png"), \
-            f"Bannerwriter URL didn't end with a .png extension: {bannerwriter_url}"
-        bannerwriter_url = bannerwriter_url[37:-4]
-        current_color = Color.White # Color is changed only when required in this URL type. Default is white.
         lines: List[List[Banner | None]] = []
         line: List[Banner | None] = []
         banner = None
-
-        for char in bannerwriter_url:
-            for color in Color:
-                if color.bannerwriter_url_index == char:
-                    current_color = color
-                    break
+        for token in bannerwriter_tokens(bannerwriter_url):
+            if token == BANNERWRITER_SPACE or token == BANNERWRITER_NEWLINE:
+                if banner:
+                    line.append(banner)
+                banner = None
+                if token == BANNERWRITER_NEWLINE:
+                    lines.append(line)
+                    line = []
+            elif token.pattern == Pattern.Banner:
+                if banner:
+                    line.append(banner)
+                banner = Banner(base_color=token.color, layers=[])
             else:
-                if char == ".":
-                    if banner:
-                        line.append(banner)
-                    banner = Banner(base_color=current_color, layers=[])
-                for pattern in Pattern:
-                    if pattern.bannerwriter_url_index == char:
-                        if not banner:
-                            raise ValueError("Banner had no background")
-                        banner.layers.append(Layer(current_color, pattern))
-                        break
-                else:
-                    if char == "_":
-                        if banner:
-                            line.append(banner)
-                        banner = None
-                    elif char == "~":
-                        if banner:
-                            line.append(banner)
-                        banner = None
-                        lines.append(line)
-                        line = []
-                    else:
-                        raise ValueError(f"Invalid character detected: {char}")
+                if not banner:
+                    raise ValueError("Banner had no background")
+                banner.layers.append(token)
         if banner:
             line.append(banner)
         lines.append(line)
@@ -244,16 +428,16 @@ class Banner:
         assert planetminecraft_url.startswith("https://www.planetminecraft.com/banner/?b="), \
             f"Not a planetminecraft URL: {planetminecraft_url}"
         planetminecraft_url = planetminecraft_url[42:]
-        for base_color in Color:
-            if base_color.planetminecraft_url_index == planetminecraft_url[0]: break
-        else: raise ValueError(f"Invalid color: {planetminecraft_url[0]}")
+        if not planetminecraft_url: raise ValueError("The planetminecraft URL has no banner")
+        base_color = PLANETMINECRAFT_URL_INDEX_TO_COLOR.get(planetminecraft_url[0])
+        if base_color is None: raise ValueError(f"Invalid color: {planetminecraft_url[0]}")
         layer_parts = [planetminecraft_url[x:x+2] for x in range(1, len(planetminecraft_url), 2)]
         layers = [Layer.from_planetminecraft_url_part(layer_part) for layer_part in layer_parts]
         return cls(base_color, layers)
     
     @classmethod
     def from_banner_url(cls, url: str) -> "Banner":
-        if url.startswith("https://banner-writer.web.app/image/"):
+        if url.startswith(BANNERWRITER_URL_PREFIX):
             return cls.from_bannerwriter_url(url)
         elif url.startswith("https://www.planetminecraft.com/banner/?b="):
             return cls.from_planetminecraft_url(url)
@@ -275,7 +459,7 @@ Copyable: ```
 Banner code: `{self.banner_code}`
 URL: {urlize(self.planetminecraft_url)}"""
     
-    def as_components(self, img_path: str, selected: int | None = None) -> list[hikari.api.ComponentBuilder]:
+    def as_components(self, image: hikari.Resourceish, selected: int | None = None) -> list[hikari.api.ComponentBuilder]:
         return [
             hikari.impl.TextDisplayComponentBuilder(content=self.description),
             hikari.impl.SectionComponentBuilder(
@@ -306,7 +490,7 @@ URL: {urlize(self.planetminecraft_url)}"""
             hikari.impl.MediaGalleryComponentBuilder(
                 items=[
                     hikari.impl.MediaGalleryItemBuilder(
-                        media=img_path,
+                        media=image,
                     ),
                 ]
             ),
@@ -362,66 +546,208 @@ URL: {urlize(self.planetminecraft_url)}"""
         ]
 
     def copy(self) -> "Banner":
-        return Banner(self.base_color, [layer.copy() for layer in self.layers])
-
-async def __show_callback(path, ctx: lightbulb.Context, banner: Banner, for_everyone: bool, editable: bool):
+        return Banner(self.base_color, list(self.layers))
+
+BANNER_IMAGE_VARIANTS: dict[str, Callable[[Image.Image, int], Image.Image]] = {
+    "full": lambda image, scale: image,
+    "thumbnail": lambda image, scale: image.crop((-10 * scale, 0, 30 * scale, 40 * scale)), # Centered in a square
+}
+BANNER_PNG_CACHE_BYTES = 8_000_000
+BANNER_PNGS: LRUCache[tuple[bytes, int, str], bytes] = LRUCache(BANNER_PNG_CACHE_BYTES, size_of = len)
+
+async def banner_attachment(banner: Banner, scale: int = 4, variant: str = "full",
+                            user_id: int | None = None) -> hikari.Bytes:
+    """The encoded banner image. Repeated views of the same design are served from the cache without rendering"""
+    key = (banner.key, scale, variant)
+    data = BANNER_PNGS.get(key)
+    if data is None:
+        snapshot = banner.copy() # The design may be edited while it is being rendered
+        async with RENDER_ADMISSION.admit(user_id, 20 * scale * 40 * scale):
+            data = await RENDER_EXECUTOR.run(
+                lambda: encode_png(BANNER_IMAGE_VARIANTS[variant](snapshot.render(scale), scale))
+            )
+        BANNER_PNGS.put(key, data)
+    return hikari.Bytes(data, "banner.png")
+
+async def __show_callback(attachment: hikari.Bytes, ctx: lightbulb.Context, banner: Banner, for_everyone: bool,
+                          editable: bool):
     if editable:
         await ctx.respond(
-            components = banner.as_components(path),
+            components = banner.as_components(attachment),
             ephemeral = not for_everyone
         )
     else:
         await ctx.respond(
             banner.description + "\n" + banner.layers_description,
-            attachment = hikari.File(path),
+            attachment = attachment,
             ephemeral = not for_everyone
         )
 
 async def respond_with_banner(ctx, banner: Banner, for_everyone = False, editable = True):
-	await save_temporarily(__show_callback, banner.image.resize((80, 160), Image.Resampling.NEAREST),
-						   ctx, banner, for_everyone, editable)
+	await __show_callback(await banner_attachment(banner, user_id=ctx.user.id),
+						  ctx, banner, for_everyone, editable)
 
-async def __edit_callback(path, interaction: hikari.ComponentInteraction, banner: Banner, selected: int | None):
-    await interaction.edit_initial_response(components = banner.as_components(path, selected))
+async def __edit_callback(attachment: hikari.Bytes, interaction: hikari.ComponentInteraction, banner: Banner,
+                          selected: int | None):
+    await interaction.edit_initial_response(components = banner.as_components(attachment, selected))
 
 async def edit_for_banner(interaction: hikari.ComponentInteraction, banner: Banner, selected: int | None = None):
-    await save_temporarily(__edit_callback, banner.image.resize((80, 160), Image.Resampling.NEAREST),
-						   interaction, banner, selected)
+    await __edit_callback(await banner_attachment(banner, user_id=interaction.user.id),
+                          interaction, banner, selected)
 
-async def __edit_color_callback(path, interaction: hikari.ComponentInteraction, description: str, button_prefix: str,
-                                selected: Color | None, final_buttons: list[dict[str]]):
+async def __edit_color_callback(attachment: hikari.Bytes | None, interaction: hikari.ComponentInteraction,
+                                description: str, button_prefix: str, selected: Color | None,
+                                final_buttons: list[dict[str]]):
     await interaction.edit_initial_response(
-        components = Color.as_components(description, path, button_prefix, selected, final_buttons)
+        components = Color.as_components(description, attachment, button_prefix, selected, final_buttons)
     )
 
 async def edit_for_color(interaction: hikari.ComponentInteraction, banner: Banner | None, description: str,
                          button_prefix: str, selected: Color | None, final_buttons: list[dict[str]]):
     if banner:
-        await save_temporarily(__edit_color_callback,
-                               banner.image.resize((80, 160), Image.Resampling.NEAREST).crop((-40, 0, 120, 160)),
-                               interaction, description, button_prefix, selected, final_buttons)
+        await __edit_color_callback(await banner_attachment(banner, variant="thumbnail", user_id=interaction.user.id),
+                                    interaction, description, button_prefix, selected, final_buttons)
     else:
         await __edit_color_callback(None, interaction, description, button_prefix, selected, final_buttons)
 
-async def __edit_pattern_callback(path, interaction: hikari.ComponentInteraction, description: str, button_prefix: str,
-                                  selected: Pattern | None, final_buttons: list[dict[str]], page_no: int | None):
+async def __edit_pattern_callback(attachment: hikari.Bytes | None, interaction: hikari.ComponentInteraction,
+                                  description: str, button_prefix: str, selected: Pattern | None,
+                                  final_buttons: list[dict[str]], page_no: int | None):
     await interaction.edit_initial_response(
-        components = Pattern.as_components(description, path, button_prefix, selected, final_buttons, page_no)
+        components = Pattern.as_components(description, attachment, button_prefix, selected, final_buttons, page_no)
     )
 
 async def edit_for_pattern(interaction: hikari.ComponentInteraction, banner: Banner, description: str, button_prefix: str,
                            selected: Pattern | None, final_buttons: list[dict[str]], page_no: int | None):
     if banner:
-        await save_temporarily(__edit_pattern_callback,
-                               banner.image.resize((80, 160), Image.Resampling.NEAREST).crop((-40, 0, 120, 160)),
-                               interaction, description, button_prefix, selected, final_buttons, page_no)
+        await __edit_pattern_callback(await banner_attachment(banner, variant="thumbnail", user_id=interaction.user.id),
+                                      interaction, description, button_prefix, selected, final_buttons, page_no)
     else:
         await __edit_pattern_callback(None, interaction, description, button_prefix, selected, final_buttons, page_no)
 
+def parse_banner_list(text: str) -> List[tuple[str | None, Banner]]:
+    """
+    Read a list of banners, one per line: a banner code or URL, optionally preceded by the name of the banner.
+    Empty lines are skipped
+    """
+    output = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line: continue
+        name, _, banner_part = line.rpartition(" ")
+        name = name.strip() or None
+        try:
+            if banner_part.startswith("https://"):
+                banner = Banner.from_banner_url(banner_part)
+            else:
+                banner = Banner.from_banner_code(banner_part)
+        except (AssertionError, ValueError) as e:
+            raise ValueError(f"Line {line_no}: {e}")
+        output.append((name, banner))
+    return output
+
+def banner_set_to_text(banner_set: "BannerSet") -> str:
+    """The banners of the set as read by `parse_banner_list`: a name and a banner code per line"""
+    return "".join(f"{name} {banner.banner_code}\n" for name, banner in banner_set.banners.items())
+
+BANNER_SET_MAGIC = b"BSET\x02"
+
+def banner_set_to_bytes(banner_set: "BannerSet") -> bytes:
+    """
+    The set in a packed binary format: `BANNER_SET_MAGIC`, the set settings,
+    then the number of banners and each banner as its name and its `Banner.key`
+    """
+    def pack_bytes(data: bytes, name: str) -> bytes:
+        if len(data) > 0xFFFF: raise ValueError(f"Banner `{name}` is too large to export")
+        return struct.pack(">H", len(data)) + data
+
+    def pack_str(text: str) -> bytes:
+        return pack_bytes(text.encode("utf-8"), text)
+
+    parts = [
+        BANNER_SET_MAGIC,
+        struct.pack(">BBB", banner_set.writing_direction.value, banner_set.newline_direction.value,
+                    list(SplitMode).index(banner_set.split_mode)),
+        pack_str(banner_set.space_char),
+        pack_str(banner_set.newline_char),
+        struct.pack(">I", len(banner_set.banners)),
+    ]
+    for name, banner in banner_set.banners.items():
+        parts += [pack_str(name), pack_bytes(banner.key, name)]
+    return b"".join(parts)
+
+def banner_set_from_bytes(data: bytes) -> "BannerSet":
+    """Read a set written by `banner_set_to_bytes`"""
+    assert data.startswith(BANNER_SET_MAGIC), "Not a banner set file"
+    offset = len(BANNER_SET_MAGIC)
+
+    def read(length: int) -> bytes:
+        nonlocal offset
+        if offset + length > len(data): raise ValueError("The banner set file is truncated")
+        offset += length
+        return data[offset - length:offset]
+
+    def read_str() -> str:
+        return read(struct.unpack(">H", read(2))[0]).decode("utf-8")
+
+    writing_direction, newline_direction, split_mode = read(3)
+    if split_mode >= len(SplitMode): raise ValueError(f"Unknown split mode: {split_mode}")
+    banner_set = BannerSet(Direction(writing_direction), Direction(newline_direction), read_str(), read_str(),
+                           list(SplitMode)[split_mode])
+    banners = {}
+    for _ in range(struct.unpack(">I", read(4))[0]):
+        name = read_str()
+        banners[name] = Banner.from_key(read(struct.unpack(">H", read(2))[0]))
+    banner_set.banners.update(banners)
+    return banner_set
+
+class BannerDict(Dict[str, Banner]):
+    """Banners by name. The names are compiled for splitting when first needed, and again after they change"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__name_index: NameIndex | None = None
+
+    @property
+    def name_index(self) -> NameIndex:
+        if self.__name_index is None: self.__name_index = NameIndex(self)
+        return self.__name_index
+
+    def __setitem__(self, name: str, banner: Banner):
+        if name not in self: self.__name_index = None
+        super().__setitem__(name, banner)
+
+    def __delitem__(self, name: str):
+        self.__name_index = None
+        super().__delitem__(name)
+
+    def __ior__(self, other):
+        self.__name_index = None
+        return super().__ior__(other)
+
+    def pop(self, *args):
+        self.__name_index = None
+        return super().pop(*args)
+
+    def popitem(self):
+        self.__name_index = None
+        return super().popitem()
+
+    def setdefault(self, name: str, default: Banner = None):
+        if name not in self: self.__name_index = None
+        return super().setdefault(name, default)
+
+    def update(self, *args, **kwargs):
+        self.__name_index = None
+        super().update(*args, **kwargs)
+
+    def clear(self):
+        self.__name_index = None
+        super().clear()
+
 class BannerSet:
     def __init__(self, writing_direction: Direction, newline_direction: Direction, space_char: str, newline_char: str,
                  split_mode: SplitMode):
-        self.banners: Dict[str, Banner] = {}
+        self.banners = BannerDict()
         self.__writing_direction = writing_direction
         self.__newline_direction = newline_direction
         self.__space_char = space_char
@@ -443,6 +769,16 @@ class BannerSet:
     @property
     def split_mode(self): return self.__split_mode
 
+    @property
+    def banners(self) -> BannerDict: return self.__banners
+
+    @banners.setter
+    def banners(self, banners: Dict[str, Banner]):
+        self.__banners = banners if isinstance(banners, BannerDict) else BannerDict(banners)
+
+    @property
+    def name_index(self) -> NameIndex: return self.__banners.name_index
+
 class BannerJSONEncoder(JSONEncoder):
     def default(self, o: Any) -> Any:
         if isinstance(o, SplitMode):
@@ -44,12 +44,12 @@ class Color(Enum):
         return COLOR_TO_PLANETMINECRAFT_URL_INDEX[self]
     
     @classmethod
-    def as_components(cls, description: str, thumbnail_path: str = None, button_prefix: str = None, selected: 'Color' = None,
+    def as_components(cls, description: str, thumbnail: hikari.Resourceish = None, button_prefix: str = None, selected: 'Color' = None,
                       final_buttons: list[dict[str]] = []):
         result = [hikari.impl.TextDisplayComponentBuilder(content=description)]
-        if thumbnail_path:
+        if thumbnail is not None:
             result = [hikari.impl.SectionComponentBuilder(
-                accessory=hikari.impl.ThumbnailComponentBuilder(media=thumbnail_path),
+                accessory=hikari.impl.ThumbnailComponentBuilder(media=thumbnail),
                 components=result
             )]
         colors = list_to_groups(cls)
@@ -197,12 +197,12 @@ class Pattern(Enum):
         return PATTERN_TO_PLANETMINECRAFT_URL_INDEX.get(self)
 
     @classmethod
-    def as_components(cls, description: str, thumbnail_path: str = None, button_prefix: str = None, selected: 'Pattern' = None,
+    def as_components(cls, description: str, thumbnail: hikari.Resourceish = None, button_prefix: str = None, selected: 'Pattern' = None,
                       final_buttons: list[dict[str]] = [], page_no: int = None):
         result = [hikari.impl.TextDisplayComponentBuilder(content=description)]
-        if thumbnail_path:
+        if thumbnail is not None:
             result = [hikari.impl.SectionComponentBuilder(
-                accessory=hikari.impl.ThumbnailComponentBuilder(media=thumbnail_path),
+                accessory=hikari.impl.ThumbnailComponentBuilder(media=thumbnail),
                 components=result
             )]
         if page_no is None:
@@ -435,4 +435,17 @@ UNICODE_LOOKALIKES = {
     Pattern.BaseGradient: "⏶",
     Pattern.Flow: "𖦹",
     Pattern.Guster: "⏚"
-}
\ No newline at end of file
+}
+
+UNICODE_INDEX_TO_COLOR = {index: color for color, index in COLOR_TO_UNICODE_INDEX.items()}
+BANNERWRITER_URL_INDEX_TO_COLOR = {index: color for color, index in COLOR_TO_BANNERWRITER_URL_INDEX.items()}
+PLANETMINECRAFT_URL_INDEX_TO_COLOR = {index: color for color, index in COLOR_TO_PLANETMINECRAFT_URL_INDEX.items()}
+BANNER_CODE_TO_COLOR = {str(color.value): color for color in Color}
+PRETTY_NAME_TO_COLOR = {color.pretty_name: color for color in Color}
+
+DATA_VALUE_TO_PATTERN = {data_value: pattern for pattern, data_value in PATTERN_TO_DATA_VALUE.items()}
+BANNERWRITER_URL_INDEX_TO_PATTERN = {index: pattern for pattern, index in PATTERN_TO_BANNERWRITER_URL_INDEX.items()}
+PLANETMINECRAFT_URL_INDEX_TO_PATTERN = {
+    index: pattern for pattern, index in PATTERN_TO_PLANETMINECRAFT_URL_INDEX.items() if index is not None
+}
+PRETTY_NAME_TO_PATTERN = {pattern.pretty_name: pattern for pattern in Pattern}
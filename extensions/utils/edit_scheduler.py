@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+class EditScheduler:
+    """
+    Sends message edits in the background. Edits are grouped by channel and sent one at a time within a channel,
+    since Discord rate limits them by channel, while up to `max_channels` channels are worked on at once.
+    An edit scheduled for a message that already has one waiting replaces it, so only the latest one is sent
+
+    :param int max_channels: How many channels may have an edit in flight at once
+    """
+    def __init__(self, max_channels: int):
+        self.max_channels = max_channels
+        self.__slots = asyncio.Semaphore(max_channels)
+        self.__pending: dict[int, dict[int, tuple[Callable[[], Awaitable], asyncio.Future[bool]]]] = {}
+        self.__workers: dict[int, asyncio.Task] = {}
+        self.last_error: Exception | None = None
+
+    def schedule(self, channel_id: int, message_id: int, edit: Callable[[], Awaitable]) -> asyncio.Future[bool]:
+        """
+        Schedule the edit of the message. It should build the new content when called, not when scheduled
+        :return: A future resolved to whether the edit succeeded, shared with the edits it replaced
+        """
+        channel = self.__pending.setdefault(channel_id, {})
+        previous = channel.pop(message_id, None)
+        future = previous[1] if previous else asyncio.get_running_loop().create_future()
+        channel[message_id] = (edit, future)
+        if channel_id not in self.__workers:
+            self.__workers[channel_id] = asyncio.create_task(self.__work(channel_id))
+        return future
+
+    async def __work(self, channel_id: int):
+        try:
+            async with self.__slots:
+                channel = self.__pending[channel_id]
+                while channel:
+                    message_id = next(iter(channel))
+                    edit, future = channel.pop(message_id)
+                    try:
+                        await edit()
+                    except Exception as e:
+                        logger.exception("Could not edit message %s in channel %s", message_id, channel_id)
+                        self.last_error = e
+                        if not future.done(): future.set_result(False)
+                    else:
+                        if not future.done(): future.set_result(True)
+        finally:
+            # Nothing can be scheduled between the queue running empty and this
+            for _, future in self.__pending.pop(channel_id).values():
+                if not future.done(): future.set_result(False)
+            del self.__workers[channel_id]
@@ -1,20 +1,29 @@
 from extensions.utils import JSONifyable
 from json import JSONEncoder
-from typing import Any
+from typing import Any, Iterable, Mapping
 import re, inspect, sys
 
 class MessageText:
+    """
+    Message text with `{{variable}}` placeholders. The text is compiled once into segments, alternating between
+    literal text and variable names, so that rendering it is a single join
+    """
     VAR_REGEX = r"\{\{\s*(\w+)\s*\}\}"
+    VAR_PATTERN = re.compile(VAR_REGEX)
+    FORBIDDEN_VAR_PATTERN = re.compile(VAR_REGEX.replace(r"\w+", r"\S*[^\w\s]\S*"))
 
     def __init__(self, text: str):
         self.__raw = text
-        self.__variables: list[str] = []
+        self.__segments: list[str] = []
+        self.__variables: set[str] = set()
         self.__update_variables()
     
     def __update_variables(self):
-        if re.findall(self.VAR_REGEX.replace(r"\w+", r"\S*[^\w\s]\S*"), self.__raw):
+        if self.FORBIDDEN_VAR_PATTERN.search(self.__raw):
             raise ValueError("Forbidden variable name. Variable names can only consist of letters, digits and underscores (_)")
-        self.__variables = set(re.findall(self.VAR_REGEX, self.__raw))
+        # Splitting on a pattern with one group leaves the variable names at the odd positions
+        self.__segments = self.VAR_PATTERN.split(self.__raw)
+        self.__variables = set(self.__segments[1::2])
     
     @property
     def raw(self): return self.__raw
@@ -27,18 +36,17 @@ class MessageText:
     @property
     def variables(self): return self.__variables
 
-    def with_values(self, **variable_values):
-        provided_variables = set(variable_values.keys())
-        if not provided_variables.issuperset(self.__variables):
-            missing_vars = {f"'{var}'" for var in self.__variables-provided_variables}
+    def render(self, variable_values: Mapping[str, "str | Variable"]) -> str:
+        """The text with the placeholders replaced. Only the variables of the text are looked up"""
+        missing_vars = self.__variables - variable_values.keys()
+        if missing_vars:
+            missing_vars = {f"'{var}'" for var in missing_vars}
             raise TypeError(f"Missing one or several variable values: {', '.join(missing_vars)}")
-        text = self.__raw
-        variable_values = {n: (v.value if isinstance(v, Variable) else v) for n, v in variable_values.items()}
-        return re.sub(
-            self.VAR_REGEX.replace(r"\w+", "|".join(variable_values.keys())),
-            lambda match: variable_values[match.group(1)],
-            text
-        )
+        segments = self.__segments.copy()
+        for i in range(1, len(segments), 2):
+            value = variable_values[segments[i]]
+            segments[i] = value.value if isinstance(value, Variable) else value
+        return "".join(segments)
 
 class Message(JSONifyable):
     def __init__(
@@ -83,6 +91,47 @@ class Variable(JSONifyable):
         else: result += f" `{self.value}`"
         return result
 
+class VariableIndex:
+    """Which messages use which variables, updated one message at a time as message texts change"""
+    def __init__(self):
+        self.__messages_by_variable: dict[str, set[str]] = {}
+        self.__variables_by_message: dict[str, set[str]] = {}
+
+    def set_message(self, msg_name: str, var_names: Iterable[str]) -> set[str]:
+        """
+        Record the variables the message uses now
+        :return: The variables that no message uses anymore
+        """
+        var_names = set(var_names)
+        orphans = self.remove_message(msg_name) - var_names
+        if not var_names: return orphans
+        self.__variables_by_message[msg_name] = var_names
+        for var_name in var_names:
+            self.__messages_by_variable.setdefault(var_name, set()).add(msg_name)
+        return orphans
+
+    def remove_message(self, msg_name: str) -> set[str]:
+        """
+        Forget the message
+        :return: The variables that no message uses anymore
+        """
+        orphans = set()
+        for var_name in self.__variables_by_message.pop(msg_name, ()):
+            msg_names = self.__messages_by_variable[var_name]
+            msg_names.discard(msg_name)
+            if not msg_names:
+                del self.__messages_by_variable[var_name]
+                orphans.add(var_name)
+        return orphans
+
+    def messages(self, var_name: str) -> frozenset[str]:
+        return frozenset(self.__messages_by_variable.get(var_name, ()))
+
+    def variables(self, msg_name: str) -> frozenset[str]:
+        return frozenset(self.__variables_by_message.get(msg_name, ()))
+
+    def __contains__(self, var_name: str) -> bool: return var_name in self.__messages_by_variable
+
 cls_members = dict(inspect.getmembers(sys.modules[__name__], inspect.isclass))
 
 def message_json_decode_hook(json_object):
@@ -0,0 +1,235 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+import hashlib
+from io import BytesIO
+import struct
+from time import perf_counter
+from typing import AsyncIterator, Callable, Iterable, TypeVar
+import zlib
+import hikari
+import numpy as np
+from PIL import Image
+from .utils import META, UserError, LRUCache
+
+T = TypeVar('T')
+
+RENDER_WORKERS: int = META.get("Render workers", 2)
+RENDER_QUEUE_SIZE: int = META.get("Render queue size", 16)
+MAX_RENDER_PIXELS: int = META.get("Max render pixels", 40_000_000)
+RENDER_BUDGET_SECONDS: float = META.get("Render budget seconds", 2.0)
+RENDER_USER_BUDGET_SECONDS: float = META.get("Render user budget seconds", 1.0)
+RENDER_ADMISSION_TIMEOUT: float = META.get("Render admission timeout seconds", 10)
+
+class RenderExecutor:
+    """
+    Runs CPU-bound image work (compositing, layout, text drawing, PNG encoding) away from the event loop.
+    Threads are used rather than processes: Pillow and NumPy release the GIL during the heavy work,
+    and images and render caches do not need to be copied between processes
+
+    :param int workers: The number of worker threads
+    :param int queue_size: How many jobs may wait for a free worker. Further jobs are refused
+    """
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.__pool = ThreadPoolExecutor(workers, thread_name_prefix="render")
+        self.__pending = 0
+        self.jobs = 0
+        self.rejected = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+
+    @property
+    def pending(self) -> int: return self.__pending
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        if self.__pending >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise UserError("The bot is busy rendering images right now. Please try again in a moment")
+        self.__pending += 1
+        submitted = perf_counter()
+        try:
+            started, finished, result = await asyncio.get_running_loop().run_in_executor(
+                self.__pool, partial(self.__timed, func, *args, **kwargs)
+            )
+        finally:
+            self.__pending -= 1
+        self.jobs += 1
+        self.total_wait_time += started - submitted
+        self.total_run_time += finished - started
+        self.max_run_time = max(self.max_run_time, finished - started)
+        return result
+
+    @staticmethod
+    def __timed(func: Callable[..., T], *args, **kwargs) -> tuple[float, float, T]:
+        started = perf_counter()
+        result = func(*args, **kwargs)
+        return started, perf_counter(), result
+
+    def __str__(self) -> str:
+        if not self.jobs:
+            return f"0 jobs, {self.rejected} rejected"
+        return (f"{self.jobs} jobs, {self.rejected} rejected, {self.__pending} pending, "
+                f"{self.total_wait_time / self.jobs * 1000:.1f} ms average wait, "
+                f"{self.total_run_time / self.jobs * 1000:.1f} ms average run time, "
+                f"{self.max_run_time * 1000:.1f} ms max run time")
+
+RENDER_EXECUTOR = RenderExecutor(RENDER_WORKERS, RENDER_QUEUE_SIZE)
+
+class RenderCost:
+    """
+    Rough cost of rendering and encoding an image, estimated from its pixel count
+
+    :param int pixels: The number of pixels of the image
+    """
+    BYTES_PER_PIXEL = 8 # The RGBA pixels and their filtered copy for encoding
+    SECONDS_PER_PIXEL = 30e-9 # Measured on banner grids, including PNG encoding
+
+    def __init__(self, pixels: int):
+        self.pixels = pixels
+        self.bytes = pixels * self.BYTES_PER_PIXEL
+        self.seconds = pixels * self.SECONDS_PER_PIXEL
+
+class RenderAdmission:
+    """
+    Decides whether a render may start from its estimated cost. A render is refused if it is too large by itself,
+    or if its user already has `user_budget` seconds of rendering in progress. While the bot as a whole has `budget`
+    seconds of rendering in progress, it waits up to `timeout` seconds for the others to finish.
+    A render never waits or is refused for the budgets when nothing else is in progress
+
+    :param int max_pixels: The largest image that may be rendered
+    :param float budget: Estimated seconds of rendering in progress for everyone
+    :param float user_budget: Estimated seconds of rendering in progress for a single user
+    :param float timeout: How long a render may wait for the others
+    """
+    def __init__(self, max_pixels: int, budget: float, user_budget: float, timeout: float):
+        self.max_pixels = max_pixels
+        self.budget = budget
+        self.user_budget = user_budget
+        self.timeout = timeout
+        self.__in_progress = 0.0
+        self.__user_in_progress: dict[int | None, float] = {}
+        self.__finished = asyncio.Condition()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_too_large = 0
+        self.rejected_user = 0
+        self.rejected_busy = 0
+        self.admitted_pixels = 0
+        self.admitted_bytes = 0
+        self.admitted_seconds = 0.0
+        self.total_queue_time = 0.0
+
+    @property
+    def in_progress(self) -> float: return self.__in_progress
+
+    @asynccontextmanager
+    async def admit(self, user_id: int | None, pixels: int) -> AsyncIterator[RenderCost]:
+        """Hold a share of the rendering capacity while rendering an image of that many pixels for the user"""
+        cost = RenderCost(pixels)
+        if pixels > self.max_pixels:
+            self.rejected_too_large += 1
+            raise UserError(f"The image would be {pixels:,} pixels, more than the limit of {self.max_pixels:,}. "
+                            f"Try a smaller scale, margin or spacing")
+        user_in_progress = self.__user_in_progress.get(user_id, 0.0)
+        if user_id is not None and user_in_progress and user_in_progress + cost.seconds > self.user_budget:
+            self.rejected_user += 1
+            raise UserError("Your other images are still being rendered. Please wait for them to finish")
+        # Reserved before waiting, so that a single user cannot fill the queue
+        self.__user_in_progress[user_id] = user_in_progress + cost.seconds
+        try:
+            if not self.__fits(cost):
+                self.queued += 1
+                loop = asyncio.get_running_loop()
+                queued = loop.time()
+                async with self.__finished:
+                    try:
+                        await asyncio.wait_for(self.__finished.wait_for(lambda: self.__fits(cost)), self.timeout)
+                    except asyncio.TimeoutError:
+                        self.rejected_busy += 1
+                        raise UserError("The bot is busy rendering images right now. Please try again in a moment")
+                self.total_queue_time += loop.time() - queued
+            self.admitted += 1
+            self.admitted_pixels += cost.pixels
+            self.admitted_bytes += cost.bytes
+            self.admitted_seconds += cost.seconds
+            self.__in_progress += cost.seconds
+            try:
+                yield cost
+            finally:
+                self.__in_progress -= cost.seconds
+                async with self.__finished:
+                    self.__finished.notify_all()
+        finally:
+            self.__user_in_progress[user_id] -= cost.seconds
+            if self.__user_in_progress[user_id] <= 1e-9: del self.__user_in_progress[user_id]
+
+    def __fits(self, cost: RenderCost) -> bool:
+        return self.__in_progress <= 1e-9 or self.__in_progress + cost.seconds <= self.budget
+
+    def __str__(self) -> str:
+        return (f"{self.admitted} admitted ({self.admitted_pixels:,} pixels, {self.admitted_bytes / 1e6:.0f} MB, "
+                f"{self.admitted_seconds:.1f} s estimated), {self.queued} queued ({self.total_queue_time:.1f} s waited), "
+                f"rejected {self.rejected_too_large} too large, {self.rejected_user} over user budget, "
+                f"{self.rejected_busy} busy. {self.__in_progress:.2f}/{self.budget:.2f} s in progress "
+                f"for {len(self.__user_in_progress)} users")
+
+RENDER_ADMISSION = RenderAdmission(MAX_RENDER_PIXELS, RENDER_BUDGET_SECONDS, RENDER_USER_BUDGET_SECONDS,
+                                   RENDER_ADMISSION_TIMEOUT)
+
+ENCODED_PNG_CACHE_BYTES = 32_000_000
+ENCODED_PNGS: LRUCache[tuple, bytes] = LRUCache(ENCODED_PNG_CACHE_BYTES, size_of = len)
+
+def encode_png(image: Image.Image, reuse: bool = False) -> bytes:
+    """
+    :param Image.Image image: The image to encode
+    :param bool reuse: Reuse the encoding of an identical image if there was one
+    """
+    if reuse:
+        key = (image.mode, image.size, hashlib.blake2b(image.tobytes(), digest_size=16).digest())
+        data = ENCODED_PNGS.get(key)
+        if data is not None: return data
+    buffer = BytesIO()
+    image.save(buffer, "PNG")
+    data = buffer.getvalue()
+    if reuse: ENCODED_PNGS.put(key, data)
+    return data
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+def encode_png_bands(width: int, height: int, bands: Iterable[np.ndarray]) -> bytes:
+    """
+    Encode an RGBA image given as bands of rows from top to bottom, so that only one band is in memory at a time.
+    Every row uses the Up filter, which suits banners scaled up by repeating rows
+
+    :param Iterable[np.ndarray] bands: Arrays of shape (rows, width, 4), adding up to `height` rows
+    """
+    compressor = zlib.compressobj(6)
+    chunks = [PNG_SIGNATURE, png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))]
+    previous = np.zeros(width * 4, dtype=np.uint8)
+    rows_written = 0
+    for band in bands:
+        rows = band.reshape(len(band), width * 4)
+        filtered = np.empty((len(rows), width * 4 + 1), dtype=np.uint8)
+        filtered[:, 0] = 2 # Up
+        np.subtract(rows[0], previous, out=filtered[0, 1:])
+        np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+        previous = rows[-1].copy()
+        rows_written += len(rows)
+        data = compressor.compress(filtered)
+        if data: chunks.append(png_chunk(b"IDAT", data))
+    assert rows_written == height, f"Expected {height} rows, got {rows_written}"
+    chunks.append(png_chunk(b"IDAT", compressor.flush()))
+    chunks.append(png_chunk(b"IEND", b""))
+    return b"".join(chunks)
+
+async def png_attachment(image: Image.Image | None, filename: str = "banner.png", reuse: bool = False) -> hikari.Bytes | None:
+    """Encode the image in memory, ready to be attached to a message or used as component media"""
+    if image is None: return None
+    return hikari.Bytes(await RENDER_EXECUTOR.run(encode_png, image, reuse), filename)
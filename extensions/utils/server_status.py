@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any
+import aiohttp
+
+class ServerStatusPoller:
+    """
+    Fetches Minecraft server statuses from a status API without blocking the event loop.
+    One HTTP session is kept open and shared by all requests, and the servers are polled concurrently
+
+    :param str url_template: The status URL, with `{address}` in place of the server address
+    :param float timeout: How long a single request may take
+    :param int retries: How many times a failed request is tried again
+    :param float backoff: The wait before the first retry, doubled for every further one
+    """
+    def __init__(self, url_template: str, timeout: float, retries: int, backoff: float):
+        self.url_template = url_template
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.__session: aiohttp.ClientSession | None = None
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        # Created lazily, since a session must be created inside the running event loop
+        if self.__session is None or self.__session.closed:
+            self.__session = aiohttp.ClientSession(timeout=self.timeout)
+        return self.__session
+
+    async def fetch(self, address: str) -> dict[str, Any]:
+        """The decoded status of the server, retried on connection errors, timeouts and error responses"""
+        url = self.url_template.format(address=address)
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.__get_session().get(url) as response:
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries: raise
+                await asyncio.sleep(self.backoff * 2**attempt)
+
+    async def fetch_all(self, addresses: dict[str, str]) -> dict[str, dict[str, Any] | BaseException]:
+        """The statuses of the servers by name, or the error that prevented getting one"""
+        results = await asyncio.gather(*(self.fetch(address) for address in addresses.values()), return_exceptions=True)
+        return dict(zip(addresses.keys(), results))
+
+    async def close(self):
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
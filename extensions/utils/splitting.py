@@ -1,7 +1,70 @@
 from enum import Enum
-from typing import List, Callable, Optional
+from typing import Iterable, List, Callable, Optional, Union
+from .utils import CacheStats, LRUCache
 
-SplitFunc = Callable[[str, List[str]], Optional[List[str]]]
+SPLIT_CACHE_SIZE = 512 # Words remembered per banner set
+SPLIT_STATS = CacheStats() # Shared by the split caches of all banner sets
+_NOT_CACHED = object()
+
+class NameIndex:
+    """
+    Names compiled for splitting words into them: a prefix trie of the names and the length of the longest one.
+    Empty names are ignored, since they never help splitting a word.
+    The splits of recent words, including failed ones, are remembered by split mode for as long as the index lives
+    """
+    END = "" # Marks the end of a name in the trie. Never a character of the text
+
+    def __init__(self, names: Iterable[str]):
+        self.names = {name for name in names if name}
+        self.max_length = max(map(len, self.names), default=0)
+        self.trie: dict = {}
+        for name in self.names:
+            node = self.trie
+            for char in name:
+                node = node.setdefault(char, {})
+            node[self.END] = name
+        self.splits: LRUCache[tuple["SplitMode", str], Optional[List[str]]] = LRUCache(SPLIT_CACHE_SIZE, stats=SPLIT_STATS)
+
+    @classmethod
+    def of(cls, names: Union["NameIndex", Iterable[str]]) -> "NameIndex":
+        return names if isinstance(names, NameIndex) else cls(names)
+
+    def __contains__(self, name: str) -> bool: return name in self.names
+
+    def __len__(self) -> int: return len(self.names)
+
+    def split(self, text: str, split_mode: "SplitMode") -> Optional[List[str]]:
+        """Split the text with the split mode, or reuse the result of the last time. The result must not be modified"""
+        key = (split_mode, text)
+        result = self.splits.get(key, _NOT_CACHED)
+        if result is _NOT_CACHED:
+            result = split_mode.split(text, self)
+            self.splits.put(key, result)
+        return result
+
+    def match_ends(self, text: str, start: int) -> List[int]:
+        """The positions, shortest first, where the names starting at `start` in the text end"""
+        ends = []
+        node = self.trie
+        for i in range(start, min(len(text), start + self.max_length)):
+            node = node.get(text[i])
+            if node is None: break
+            if self.END in node: ends.append(i + 1)
+        return ends
+
+    def count_splits(self, text: str) -> tuple[List[int], List[List[int]]]:
+        """
+        Count the ways to split every suffix of the text into names, up to 2.
+        :return: The counts by suffix start (the empty suffix at `len(text)` has one) and the name ends at each position
+        """
+        ends = [self.match_ends(text, i) for i in range(len(text))]
+        counts = [0] * len(text) + [1]
+        for i in range(len(text) - 1, -1, -1):
+            counts[i] = min(2, sum(counts[end] for end in ends[i]))
+        return counts, ends
+
+Names = Union[NameIndex, Iterable[str]]
+SplitFunc = Callable[[str, Names], Optional[List[str]]]
 
 class SplitMode(Enum):
     No = "Do not split"
@@ -23,36 +86,35 @@ def splitter(split_mode: SplitMode):
     return __inner
 
 @splitter(SplitMode.No)
-def split(text: str, names: List[str]) -> Optional[List[str]]:
+def split(text: str, names: Names) -> Optional[List[str]]:
     return [text] if text in names else None
 
 @splitter(SplitMode.Longest)
-def split(text: str, names: List[str]) -> Optional[List[str]]:
-    if not text: return []
-    for name in sorted(names, key = len, reverse = True):
-        if text.startswith(name):
-            rest = SplitMode.Longest.split(text[len(name):], names)
-            if rest is not None:
-                return [name] + rest
-    return None
+def split(text: str, names: Names) -> Optional[List[str]]:
+    counts, ends = NameIndex.of(names).count_splits(text)
+    if not counts[0]: return None
+    output = []
+    i = 0
+    while i < len(text):
+        # The longest name after which the rest can still be split
+        end = max(end for end in ends[i] if counts[end])
+        output.append(text[i:end])
+        i = end
+    return output
 
 @splitter(SplitMode.Single)
-def split(text: str, names: List[str]) -> Optional[List[str]]:
-    if text in names:
+def split(text: str, names: Names) -> Optional[List[str]]:
+    index = NameIndex.of(names)
+    if text in index:
         return [text]
-    splits = all_splits(text, names)
-    return splits[0] if len(splits) == 1 else None
-
-def all_splits(text: str, names: List[str]) -> List[List[str]]:
-    output = _all_splits(text, names)
-    if len(output) == 1 and len(output[0]) == 0: return []
-    return output
-
-def _all_splits(text: str, names: List[str]) -> List[List[str]]:
-    if not text: return [[]]
+    if not text: return None
+    counts, ends = index.count_splits(text)
+    if counts[0] != 1: return None
     output = []
-    for name in sorted(names, key = len, reverse = True):
-        if text.startswith(name):
-            rest = _all_splits(text[len(name):], names)
-            output += [[name] + x for x in rest]
-    return output
\ No newline at end of file
+    i = 0
+    while i < len(text):
+        # Exactly one name leads to the only split
+        end = next(end for end in ends[i] if counts[end])
+        output.append(text[i:end])
+        i = end
+    return output
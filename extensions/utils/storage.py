@@ -0,0 +1,430 @@
+from abc import ABC, abstractmethod
+import asyncio
+from collections.abc import MutableMapping
+import json
+from json import JSONDecoder
+import logging
+import os
+import re
+import sqlite3
+from time import monotonic
+from weakref import WeakSet
+from typing import BinaryIO, Callable, Iterator, TypeVar
+from .banner import Banner, BannerSet, BannerJSONEncoder, banner_json_decode_hook
+from .banner_enums import Direction
+from .splitting import SplitMode
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+UserData = tuple[Banner | None, dict[str, BannerSet] | None, str | None]
+
+class UserDataView(MutableMapping[int, T]):
+    """
+    One kind of user data by user ID. The data of a user is loaded from the storage on first access.
+    Iterating only goes over the users that are currently loaded
+    """
+    def __init__(self, storage: "BannerStorage", data: dict[int, T]):
+        self.__storage = storage
+        self.__data = data
+
+    def __getitem__(self, user_id: int) -> T:
+        self.__storage.load_user(user_id)
+        return self.__data[user_id]
+
+    def __setitem__(self, user_id: int, value: T):
+        self.__storage.load_user(user_id)
+        self.__data[user_id] = value
+
+    def __delitem__(self, user_id: int):
+        self.__storage.load_user(user_id)
+        del self.__data[user_id]
+
+    def __contains__(self, user_id: object) -> bool:
+        self.__storage.load_user(user_id)
+        return user_id in self.__data
+
+    def __iter__(self) -> Iterator[int]: return iter(self.__data)
+
+    def __len__(self) -> int: return len(self.__data)
+
+class BannerStorage(ABC):
+    """
+    Keeps the banner designs, banner sets and last used sets of the users, and saves them in the background.
+    Changed users are marked dirty and written together `debounce` seconds after the last change,
+    but no later than `max_delay` seconds after the first unsaved one.
+    A background write that fails is logged and tried again `debounce` seconds later
+
+    :param float debounce: Seconds to wait for more changes before writing
+    :param float max_delay: The longest time a change may stay unsaved
+    """
+    def __init__(self, debounce: float, max_delay: float):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._designs: dict[int, Banner] = {}
+        self._sets: dict[int, dict[str, BannerSet]] = {}
+        self._last_used: dict[int, str] = {}
+        self._loaded: set[int] = set()
+        self.__last_access: dict[int, float] = {}
+        # The tasks that accessed each user. A user is not evicted while one of them runs,
+        # since it may still hold the data of the user across an await and change it
+        self.__users_tasks: dict[int, WeakSet[asyncio.Task]] = {}
+        self.designs: UserDataView[Banner] = UserDataView(self, self._designs)
+        self.sets: UserDataView[dict[str, BannerSet]] = UserDataView(self, self._sets)
+        self.last_used: UserDataView[str] = UserDataView(self, self._last_used)
+        self.writes = 0
+        self.__dirty: set[int] = set()
+        self.__first_change: float | None = None
+        self.__timer: asyncio.TimerHandle | None = None
+        self.__flush_task: asyncio.Task | None = None
+        self.__lock = asyncio.Lock()
+
+    @property
+    def dirty(self) -> set[int]: return self.__dirty
+
+    @property
+    def loaded(self) -> int: return len(self._loaded)
+
+    def load_user(self, user_id: int):
+        self.__last_access[user_id] = monotonic()
+        try: task = asyncio.current_task()
+        except RuntimeError: task = None # Outside the event loop, when loading at startup
+        if task is not None: self.__users_tasks.setdefault(user_id, WeakSet()).add(task)
+        if user_id in self._loaded: return
+        design, sets, last_used = self._load_user(user_id)
+        self._loaded.add(user_id)
+        if design is not None: self._designs[user_id] = design
+        if sets is not None: self._sets[user_id] = sets
+        if last_used is not None: self._last_used[user_id] = last_used
+
+    @abstractmethod
+    def _load_user(self, user_id: int) -> UserData:
+        """Read the design, the sets and the last used set of a user that is not loaded yet"""
+
+    def evict_idle(self, max_idle: float) -> int:
+        """
+        Forget the users that have not been accessed for `max_idle` seconds, have no unsaved changes
+        and are not used by a running task. They are read again from the storage on their next access
+
+        :return: The number of users evicted
+        """
+        threshold = monotonic() - max_idle
+        idle = [user_id for user_id in self._loaded
+                if self.__last_access.get(user_id, 0) < threshold and user_id not in self.__dirty
+                and not any(not task.done() for task in self.__users_tasks.get(user_id, ()))]
+        for user_id in idle:
+            self._loaded.discard(user_id)
+            self.__last_access.pop(user_id, None)
+            self.__users_tasks.pop(user_id, None)
+            self._designs.pop(user_id, None)
+            self._sets.pop(user_id, None)
+            self._last_used.pop(user_id, None)
+        return len(idle)
+
+    def mark_dirty(self, user_id: int):
+        # Saving a user that is not loaded would erase their stored data
+        self.load_user(user_id)
+        self.__dirty.add(user_id)
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.__first_change is None: self.__first_change = now
+        if self.__timer: self.__timer.cancel()
+        delay = min(self.debounce, self.__first_change + self.max_delay - now)
+        self.__timer = loop.call_later(max(delay, 0), self.__start_flush)
+
+    def __start_flush(self):
+        self.__timer = None
+        self.__flush_task = asyncio.ensure_future(self.flush())
+        self.__flush_task.add_done_callback(self.__flush_done)
+
+    def __flush_done(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is None: return
+        logger.error("Saving banner data failed, retrying in %s seconds", self.debounce, exc_info=task.exception())
+        # The users are dirty again, but no change may come to schedule the next write
+        if not self.__timer:
+            self.__timer = asyncio.get_running_loop().call_later(self.debounce, self.__start_flush)
+
+    async def flush(self):
+        """Write all unsaved changes now"""
+        if self.__timer:
+            self.__timer.cancel()
+            self.__timer = None
+        async with self.__lock:
+            if not self.__dirty: return
+            user_ids, first_change = self.__dirty, self.__first_change
+            self.__dirty, self.__first_change = set(), None
+            try:
+                # The data is serialized on the event loop, so no command can change it halfway
+                write = self._prepare_write(user_ids)
+                finish = await asyncio.to_thread(write)
+                if finish: finish()
+            except:
+                self.__dirty |= user_ids
+                # Still counts from the first of the unsaved changes
+                self.__first_change = min(t for t in (first_change, self.__first_change) if t is not None)
+                raise
+            self.writes += 1
+
+    @abstractmethod
+    def _prepare_write(self, user_ids: set[int]) -> Callable[[], Callable[[], None] | None]:
+        """
+        Serialize the data of the users, returning the blocking part of writing it.
+        That part may return a last step to run back on the event loop
+        """
+
+def read_banner_json(path: str) -> tuple[dict[int, Banner], dict[int, dict[str, BannerSet]], dict[int, str]]:
+    """Read a whole JSON data file into designs, sets and last used sets by user ID"""
+    with open(path, encoding="utf-8") as f:
+        data = JSONDecoder(object_hook = banner_json_decode_hook).decode(f.read())
+    return (
+        {int(k): v for k, v in data["designs"].items()},
+        {int(k): v for k, v in data["sets"].items()},
+        {int(k): v for k, v in data["last_used"].items()},
+    )
+
+class JSONBannerStorage(BannerStorage):
+    """
+    Stores everything in a single JSON file, one user per line in each section.
+    At startup only the position of each user in the file is read, and with `lazy` a user is decoded when first accessed.
+    A write copies the unchanged users from the old file and only serializes the changed ones
+
+    :param str path: The path of the JSON file
+    :param bool lazy: Decode the data of a user on first access rather than at startup
+    """
+    SECTIONS = ("designs", "sets", "last_used")
+    SECTION_REGEX = re.compile(rb'"(\w+)": \{\r?\n')
+    USER_REGEX = re.compile(rb'"(\d+)": ')
+
+    def __init__(self, path: str, debounce: float, max_delay: float, lazy: bool = False):
+        super().__init__(debounce, max_delay)
+        self.path = path
+        self.__decoder = JSONDecoder(object_hook = banner_json_decode_hook)
+        # Where the data of each user is: its offset and length in the file, or its serialized data if not written yet
+        self.__index: dict[str, dict[int, tuple[int, int] | bytes]] = {section: {} for section in self.SECTIONS}
+        self.__file: BinaryIO | None = None
+        if os.path.exists(path):
+            self.__file = open(path, "rb")
+            if not self.__build_index():
+                # Saved by an older version: read it whole, the next write saves it one user per line
+                self.__read_whole()
+        if not lazy:
+            for section in self.SECTIONS:
+                for user_id in self.__index[section]:
+                    self.load_user(user_id)
+
+    def __build_index(self) -> bool:
+        section = None
+        offset = 0
+        self.__file.seek(0)
+        for line in self.__file:
+            stripped = line.strip()
+            if section is None:
+                match = self.SECTION_REGEX.fullmatch(line)
+                if match and match[1].decode() in self.__index:
+                    section = self.__index[match[1].decode()]
+                elif stripped not in (b"{", b"}", b""):
+                    break
+            elif stripped in (b"}", b"},"):
+                section = None
+            elif stripped:
+                match = self.USER_REGEX.match(line)
+                if not match: break
+                value = line.rstrip(b"\r\n")
+                if value.endswith(b","): value = value[:-1]
+                section[int(match[1])] = (offset + match.end(), len(value) - match.end())
+            offset += len(line)
+        else:
+            return True
+        for section in self.__index.values():
+            section.clear()
+        return False
+
+    def __read_whole(self):
+        for section, data in zip(self.SECTIONS, read_banner_json(self.path)):
+            for user_id, value in data.items():
+                self.__index[section][user_id] = json.dumps(value, cls = BannerJSONEncoder).encode()
+
+    def _load_user(self, user_id: int) -> UserData:
+        values = []
+        for section in self.SECTIONS:
+            entry = self.__index[section].get(user_id)
+            if isinstance(entry, tuple):
+                offset, length = entry
+                self.__file.seek(offset)
+                entry = self.__file.read(length)
+            values.append(None if entry is None else self.__decoder.decode(entry.decode("utf-8")))
+        return tuple(values)
+
+    def _prepare_write(self, user_ids: set[int]) -> Callable[[], Callable[[], None]]:
+        for section, data in zip(self.SECTIONS, (self._designs, self._sets, self._last_used)):
+            for user_id in user_ids:
+                if user_id in data:
+                    self.__index[section][user_id] = json.dumps(data[user_id], cls = BannerJSONEncoder).encode()
+                else:
+                    self.__index[section].pop(user_id, None)
+        index = {section: dict(entries) for section, entries in self.__index.items()}
+        temp_path = self.path + ".tmp"
+
+        def write() -> Callable[[], None]:
+            new_index = {section: {} for section in self.SECTIONS}
+            old_file = open(self.path, "rb") if os.path.exists(self.path) else None
+            try:
+                with open(temp_path, "wb") as f:
+                    f.write(b"{\n")
+                    for i, section in enumerate(self.SECTIONS):
+                        if i > 0: f.write(b",\n")
+                        f.write(f'"{section}": {{\n'.encode())
+                        for j, (user_id, entry) in enumerate(index[section].items()):
+                            if isinstance(entry, tuple):
+                                offset, length = entry
+                                old_file.seek(offset)
+                                entry = old_file.read(length)
+                            if j > 0: f.write(b",\n")
+                            f.write(f'"{user_id}": '.encode())
+                            new_index[section][user_id] = (f.tell(), len(entry))
+                            f.write(entry)
+                        f.write(b"\n}")
+                    f.write(b"\n}\n")
+            finally:
+                if old_file: old_file.close()
+
+            def finish():
+                # Swapped on the event loop, so users are never read with the positions of the other file
+                if self.__file: self.__file.close()
+                os.replace(temp_path, self.path)
+                self.__file = open(self.path, "rb")
+                self.__index = new_index
+            return finish
+        return write
+
+class SQLiteBannerStorage(BannerStorage):
+    """
+    Stores the data of each user in its own rows of an SQLite database.
+    A user is read when first accessed, and a write only replaces the rows of the changed users.
+    If the database does not exist yet, it is filled from the JSON data file at `migrate_from` if there is one.
+    The migration is written to a temporary database that only replaces `path` once it is complete,
+    and the JSON file is then renamed so it is not migrated again
+
+    :param str path: The path of the database
+    :param str migrate_from: The path of a JSON data file to migrate
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS designs (
+            user_id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS last_used (
+            user_id INTEGER PRIMARY KEY,
+            set_name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS set_owners (
+            user_id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS banner_sets (
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            writing_direction INTEGER NOT NULL,
+            newline_direction INTEGER NOT NULL,
+            space_char TEXT NOT NULL,
+            newline_char TEXT NOT NULL,
+            split_mode INTEGER NOT NULL,
+            PRIMARY KEY (user_id, name)
+        );
+        CREATE TABLE IF NOT EXISTS banners (
+            user_id INTEGER NOT NULL,
+            set_name TEXT NOT NULL,
+            name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            PRIMARY KEY (user_id, set_name, name)
+        );
+    """
+    TABLES = ("designs", "last_used", "set_owners", "banner_sets", "banners")
+
+    def __init__(self, path: str, debounce: float, max_delay: float, migrate_from: str | None = None):
+        super().__init__(debounce, max_delay)
+        self.path = path
+        if migrate_from is not None and not os.path.exists(path) and os.path.exists(migrate_from):
+            self.__migrate(migrate_from)
+        # Users are read on the event loop and written from a worker thread, each with its own connection
+        self.__reader = sqlite3.connect(path, check_same_thread=False)
+        self.__reader.execute("PRAGMA journal_mode=WAL")
+        self.__reader.executescript(self.SCHEMA)
+        self.__writer = sqlite3.connect(path, check_same_thread=False)
+
+    def __migrate(self, migrate_from: str):
+        temp_path = self.path + ".tmp"
+        # Left over by a migration that failed halfway
+        if os.path.exists(temp_path): os.remove(temp_path)
+        designs, sets, last_used = read_banner_json(migrate_from)
+        user_ids = set(designs) | set(sets) | set(last_used)
+        rows = self.__rows(user_ids, designs, sets, last_used)
+        self.__writer = sqlite3.connect(temp_path)
+        try:
+            self.__writer.executescript(self.SCHEMA)
+            self.__write_rows(user_ids, rows)
+        finally:
+            self.__writer.close()
+        os.replace(temp_path, self.path)
+        os.replace(migrate_from, migrate_from + ".migrated")
+
+    def _load_user(self, user_id: int) -> UserData:
+        design = self.__reader.execute("SELECT code FROM designs WHERE user_id = ?", (user_id,)).fetchone()
+        last_used = self.__reader.execute("SELECT set_name FROM last_used WHERE user_id = ?", (user_id,)).fetchone()
+        set_rows = self.__reader.execute(
+            "SELECT name, writing_direction, newline_direction, space_char, newline_char, split_mode "
+            "FROM banner_sets WHERE user_id = ? ORDER BY position", (user_id,)
+        ).fetchall()
+        # Tells a user with an empty dict of sets apart from a user with no sets entry
+        owner = self.__reader.execute("SELECT 1 FROM set_owners WHERE user_id = ?", (user_id,)).fetchone()
+        sets = None
+        if set_rows or owner:
+            sets = {
+                name: BannerSet(Direction(writing_direction), Direction(newline_direction), space_char, newline_char,
+                                list(SplitMode)[split_mode])
+                for name, writing_direction, newline_direction, space_char, newline_char, split_mode in set_rows
+            }
+            for set_name, name, code in self.__reader.execute(
+                "SELECT set_name, name, code FROM banners WHERE user_id = ? ORDER BY set_name, position", (user_id,)
+            ):
+                sets[set_name].banners[name] = Banner.from_banner_code(code)
+        return (
+            Banner.from_banner_code(design[0]) if design else None,
+            sets,
+            last_used[0] if last_used else None,
+        )
+
+    @staticmethod
+    def __rows(user_ids: set[int], designs: dict[int, Banner], sets: dict[int, dict[str, BannerSet]],
+               last_used: dict[int, str]) -> dict[str, list[tuple]]:
+        rows: dict[str, list[tuple]] = {table: [] for table in SQLiteBannerStorage.TABLES}
+        for user_id in user_ids:
+            if user_id in designs:
+                rows["designs"].append((user_id, designs[user_id].banner_code))
+            if user_id in last_used:
+                rows["last_used"].append((user_id, last_used[user_id]))
+            if user_id in sets:
+                rows["set_owners"].append((user_id,))
+            for set_position, (set_name, banner_set) in enumerate(sets.get(user_id, {}).items()):
+                rows["banner_sets"].append((
+                    user_id, set_name, set_position, banner_set.writing_direction.value,
+                    banner_set.newline_direction.value, banner_set.space_char, banner_set.newline_char,
+                    list(SplitMode).index(banner_set.split_mode)
+                ))
+                for position, (name, banner) in enumerate(banner_set.banners.items()):
+                    rows["banners"].append((user_id, set_name, name, position, banner.banner_code))
+        return rows
+
+    def __write_rows(self, user_ids: set[int], rows: dict[str, list[tuple]]):
+        with self.__writer:
+            for table, table_rows in rows.items():
+                self.__writer.executemany(f"DELETE FROM {table} WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+                if not table_rows: continue
+                placeholders = ", ".join("?" * len(table_rows[0]))
+                self.__writer.executemany(f"INSERT INTO {table} VALUES ({placeholders})", table_rows)
+
+    def _prepare_write(self, user_ids: set[int]) -> Callable[[], None]:
+        rows = self.__rows(user_ids, self._designs, self._sets, self._last_used)
+        return lambda: self.__write_rows(user_ids, rows)
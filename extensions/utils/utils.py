@@ -1,13 +1,24 @@
 import hikari, lightbulb
 from hikari import impl
+from collections import OrderedDict
+import json
 import os
-from pathlib import Path
-import random
 import re
-from typing import Iterable, TypeVar
-from PIL import Image, ImageFont
+import threading
+from typing import Callable, Generic, Hashable, Iterable, TypeVar
+from PIL import ImageFont
+
+if os.path.exists("meta.json"):
+    with open("meta.json", "r", encoding="utf-8") as f:
+        META: dict = json.load(f)
+else:
+    raise FileNotFoundError("meta.json is missing.\n"
+                            "If you cloned or pulled the git repo, "
+                            "make sure to copy example.meta.json, "
+                            "name it meta.json and edit for your needs.")
 
 BASE_FONT = ImageFont.truetype(font="font_noto/NotoSans.ttf")
+BASE_FONT_LOCK = threading.Lock() # FreeType fonts must not be used by several render threads at once
 RED = "#ee2d2d"
 
 class JSONifyable:
@@ -78,6 +89,69 @@ def unbuild(component: list | hikari.PartialComponent):
     
 
 T = TypeVar('T')
+K = TypeVar('K', bound=Hashable)
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate), {self.evictions} evictions"
+
+class LRUCache(Generic[K, T]):
+    """
+    Bounded least-recently-used cache
+
+    :param int max_size: The maximum total size of the stored values
+    :param size_of: The size of a value. Every value has size 1 by default, i.e. `max_size` bounds the number of items
+    :param CacheStats stats: Counters to report to. Several caches may share the same counters
+    """
+    def __init__(self, max_size: int, size_of: Callable[[T], int] = lambda _: 1, stats: CacheStats | None = None):
+        self.max_size = max_size
+        self.size = 0
+        self.stats = stats or CacheStats()
+        self.__size_of = size_of
+        self.__items: OrderedDict[K, T] = OrderedDict()
+        self.__lock = threading.Lock() # Render caches are used from the render worker threads
+
+    def __len__(self) -> int: return len(self.__items)
+
+    def __contains__(self, key: K) -> bool: return key in self.__items
+
+    def get(self, key: K, default: T | None = None) -> T | None:
+        with self.__lock:
+            if key not in self.__items:
+                self.stats.misses += 1
+                return default
+            self.stats.hits += 1
+            self.__items.move_to_end(key)
+            return self.__items[key]
+
+    def put(self, key: K, value: T) -> None:
+        value_size = self.__size_of(value)
+        with self.__lock:
+            if key in self.__items:
+                self.size -= self.__size_of(self.__items.pop(key))
+            if value_size > self.max_size: return # Would evict everything else and still not fit
+            self.__items[key] = value
+            self.size += value_size
+            while self.size > self.max_size:
+                _, evicted = self.__items.popitem(last=False)
+                self.size -= self.__size_of(evicted)
+                self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__items.clear()
+            self.size = 0
+
 def list_to_groups(iterable: Iterable[T], group_size: int = 5) -> list[list[T]]:
     result = [[]]
     for element in iterable:
@@ -85,17 +159,3 @@ def list_to_groups(iterable: Iterable[T], group_size: int = 5) -> list[list[T]]:
             result.append([])
         result[-1].append(element)
     return result
-
-async def save_temporarily(callback, image: Image.Image | None, *args, **kwargs):
-    if image is None:
-        await callback(None, *args, **kwargs)
-        return None
-    temp_path = "temp"
-    Path(temp_path).mkdir(parents=True, exist_ok=True)
-    while True:
-        filename = "".join(chr(random.randint(ord("a"), ord("z"))) for _ in range(8))
-        path = os.path.join(temp_path, filename + ".png")
-        if path not in os.listdir(temp_path): break
-    image.save(path)
-    await callback(path, *args, **kwargs)
-    os.remove(path)
@@ -0,0 +1,112 @@
+"""
+Benchmark of banner decoding: the enum scans used before the reverse lookup tables against the current parsers.
+Run from the repository root with a meta.json, since the banner module loads its fonts, textures and settings
+from there:
+
+    python scripts/bench_banner_decoding.py [number of banners]
+"""
+
+import os
+import random
+import re
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.getcwd())
+from extensions.utils.banner import Banner, Layer
+from extensions.utils.banner_enums import Color, Pattern
+
+# The decoders as they were, scanning Color and Pattern for every character or part
+
+def old_layer_from_character(char: str) -> Layer:
+    value = ord(char)
+    assert 0xE000 <= value < 0xF000, f"Character U+{hex(value)[2:].zfill(4)} is out of range"
+    value -= 0xE000
+    pattern_index = int(hex(value % 0x100)[2:])
+    for pattern in Pattern:
+        if pattern.value == pattern_index: break
+    else: raise ValueError(f"No pattern indexed with {pattern_index}")
+    color_index = value // 0x100
+    for color in Color:
+        if color.unicode_index == color_index: break
+    else: raise ValueError("Unreachable")
+    return Layer(color, pattern)
+
+def old_from_text(text: str) -> Banner:
+    assert set(text) <= {"\U000CFFF7"} | set(chr(c) for c in range(0xE000, 0xF000)), "Please use banner text"
+    assert set(text[1::2]) == {"\U000CFFF7"}, "Only one banner should be provided"
+    all_layers = [old_layer_from_character(c) for c in text[::2]]
+    assert all_layers[0].pattern == Pattern.Banner, "The banner should start with a full pattern"
+    return Banner(all_layers[0].color, all_layers[1:])
+
+def old_layer_from_banner_code_part(part: str) -> Layer:
+    match = re.compile(r"([a-z]+)(\d+)").fullmatch(part)
+    assert match, f"Invalid code part: {part}"
+    pattern_part, color_part = match.groups()
+    for pattern in Pattern:
+        if pattern.data_value == pattern_part: break
+    else: raise ValueError(f"Invalid pattern: {pattern_part}")
+    for color in Color:
+        if str(color.value) == color_part: break
+    else: raise ValueError(f"Invalid color: {color_part}")
+    return Layer(color, pattern)
+
+def old_from_banner_code(banner_code: str) -> Banner:
+    assert re.compile(r"[a-z\d]+").fullmatch(banner_code), f"Invalid banner code: {banner_code}"
+    parts = re.compile(r"([a-z]+\d+)").sub(r"\1,", banner_code).split(",")[:-1]
+    all_layers = [old_layer_from_banner_code_part(part) for part in parts]
+    assert all_layers, f"Invalid banner code: {banner_code}"
+    assert all_layers[0].pattern == Pattern.Banner, "The banner should start with a full pattern"
+    return Banner(all_layers[0].color, all_layers[1:])
+
+def old_layer_from_planetminecraft_url_part(part: str) -> Layer:
+    assert len(part) == 2, f"Invalid URL part: {part}"
+    color_char, pattern_char = part
+    for color in Color:
+        if color.planetminecraft_url_index == color_char: break
+    else: raise ValueError(f"Invalid color: {color_char}")
+    for pattern in Pattern:
+        if pattern.planetminecraft_url_index == pattern_char: break
+    else: raise ValueError(f"Invalid pattern: {pattern_char}")
+    return Layer(color, pattern)
+
+def old_from_planetminecraft_url(planetminecraft_url: str) -> Banner:
+    planetminecraft_url = planetminecraft_url[42:]
+    for base_color in Color:
+        if base_color.planetminecraft_url_index == planetminecraft_url[0]: break
+    else: raise ValueError(f"Invalid color: {planetminecraft_url[0]}")
+    layer_parts = [planetminecraft_url[x:x+2] for x in range(1, len(planetminecraft_url), 2)]
+    return Banner(base_color, [old_layer_from_planetminecraft_url_part(part) for part in layer_parts])
+
+def random_banners(count: int) -> list[Banner]:
+    random.seed(0)
+    patterns = [pattern for pattern in Pattern
+                if pattern != Pattern.Banner and pattern.planetminecraft_url_index is not None]
+    return [
+        Banner(random.choice(list(Color)),
+               [Layer(random.choice(list(Color)), random.choice(patterns)) for _ in range(random.randint(1, 6))])
+        for _ in range(count)
+    ]
+
+def bench(name: str, encoded: list[str], old, new):
+    start = perf_counter()
+    old_banners = [old(value) for value in encoded]
+    middle = perf_counter()
+    new_banners = [new(value) for value in encoded]
+    end = perf_counter()
+    assert [b.key for b in old_banners] == [b.key for b in new_banners], f"{name}: the decoders disagree"
+    print(f"{name:<26} {(middle - start) / len(encoded) * 1e6:8.1f} us {(end - middle) / len(encoded) * 1e6:8.1f} us "
+          f"{(middle - start) / (end - middle):6.1f}x")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    banners = random_banners(count)
+    print(f"{count} banners with 1-6 layers, per banner")
+    print(f"{'':<26} {'before':>11} {'after':>11} {'speedup':>7}")
+    bench("from_banner_code", [b.banner_code for b in banners], old_from_banner_code, Banner.from_banner_code)
+    bench("from_text", [b.text for b in banners], old_from_text, Banner.from_text)
+    bench("from_planetminecraft_url", ["https://www." + b.planetminecraft_url for b in banners],
+          old_from_planetminecraft_url, Banner.from_planetminecraft_url)
+
+if __name__ == "__main__":
+    main()